@@ -0,0 +1,98 @@
+"""
+Adaptive ping rate.
+
+AdaptiveRate watches each sweep's results.  When a target is missing from them
+(it errored or timed out), or shows packet loss, or an average RTT well above
+its usual level, the ping interval drops straight to minInterval (and
+optionally more pings are sent per run).  Once the sweeps are clean again the
+interval backs off exponentially until it is back at the configured runEvery.
+
+.. code-block:
+
+    from adaptive import AdaptiveRate
+    rate = AdaptiveRate(baseInterval=90, minInterval=10)
+    interval, count = rate.observe(sweep_results, expected=len(targets))
+    scheduler.set_interval("ping", interval)
+"""
+
+
+class AdaptiveRate():
+    """
+    Chooses the ping interval and count from the most recent sweep.
+    """
+    def __init__(self, baseInterval, minInterval=10, backoff=2.0,
+                 baseCount=5, incidentCount=None, rttFactor=3.0, smoothing=0.2):
+        """
+        Args:
+            baseInterval (float): The normal interval, runEvery.
+            minInterval (float): The interval used during an incident.
+            backoff (float): Factor the interval grows by after each clean
+                sweep, until it is back at baseInterval.
+            baseCount (integer): Pings per run normally, numPings.
+            incidentCount (integer): Pings per run during an incident,
+                defaults to baseCount.
+            rttFactor (float): An average RTT more than this many times the
+                target's usual average is treated as a spike.
+            smoothing (float): Weight of each new sample in the usual
+                (exponentially weighted) average RTT.
+        """
+        self.baseInterval = float(baseInterval)
+        self.minInterval = min(float(minInterval), self.baseInterval)
+        self.backoff = float(backoff)
+        self.baseCount = baseCount
+        self.incidentCount = incidentCount or baseCount
+        self.rttFactor = float(rttFactor)
+        self.smoothing = float(smoothing)
+        self.interval = self.baseInterval
+        self.count = self.baseCount
+        self.baselines = {}
+
+    def is_incident(self, result):
+        """
+        Returns:
+            Boolean: True if this target's result shows loss or an RTT spike.
+                Updates the target's usual RTT when it does not.
+        """
+        if result["Packet Loss #"] > 0:
+            return True
+        average = result["Avg"]
+        if average is None:
+            return False
+        average = float(average)
+        baseline = self.baselines.get(result["target"])
+        if baseline is not None and average > baseline * self.rttFactor:
+            # Keep spikes out of the baseline, or a long incident would
+            # become the new normal.
+            return True
+        if baseline is None:
+            self.baselines[result["target"]] = average
+        else:
+            self.baselines[result["target"]] = baseline + self.smoothing * (average - baseline)
+        return False
+
+    def observe(self, results, expected=None):
+        """
+        Update the rate from one sweep.
+
+        Args:
+            results (list): The PingTest result dictionaries of the sweep.
+            expected (integer): The number of targets pinged.  A sweep with
+                fewer results (targets that errored or timed out without a
+                row), or none at all, is an incident.
+
+        Returns:
+            tuple: (interval in seconds, pings per run)
+        """
+        results = results or []
+        incident = not results or (expected is not None and len(results) < expected)
+        for result in results:
+            # no short circuit, every target's baseline is updated
+            incident = self.is_incident(result) or incident
+        if incident:
+            self.interval = self.minInterval
+            self.count = self.incidentCount
+        else:
+            self.interval = min(self.baseInterval, self.interval * self.backoff)
+            if self.interval >= self.baseInterval:
+                self.count = self.baseCount
+        return self.interval, self.count
@@ -0,0 +1,292 @@
+"""
+Export the closed, rotated result logs to Parquet.
+
+Each closed log in the data directory (plain or compressed) is read with
+BaseCsvFile, converted to typed columns (timestamps for the dates, int64 for
+the packet counts, float64 for the measurements, strings for the rest), and
+written as Parquet, partitioned by day.  The ping, speedtest and traceroute
+logs each have one fixed schema, the columns and types of their
+sqlite_store.SCHEMAS table, so the partitions of a stream always merge:
+
+    <output>/<suffix>/date=2021-07-23/2021-07-23-pingresults.parquet
+
+so pandas / pyarrow can load a range of days without re-parsing any CSV:
+
+    pandas.read_parquet("export/pingresults")
+
+Only the files that have been rotated out are exported, and only once;
+exported.json in the output directory records the size and mtime of each
+file already done.  Requires pyarrow.
+
+.. code-block:
+
+    python columnar_export.py [data directory] [output directory]
+
+    from columnar_export import export_directory
+    export_directory("data", "export")
+"""
+import json
+import os
+import sys
+import time
+import traceback
+from datetime import datetime
+
+from csv_common import BaseCsvFile, COMPRESSED_SUFFIXES
+from log_query import STREAMS
+from rotating_csv import parse_filename
+from sqlite_store import SCHEMAS
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+TIMESTAMP_COLUMNS = ("Date", "Ping DateTime")
+STRING_COLUMNS = ("target", "Location", "Up readable", "Down readable", "capture",
+                  "Path Id", "Hops")
+INT_COLUMNS = ("Success", "Sent", "Received", "Packet Loss #")
+STATE_FILE = "exported.json"
+
+
+def is_closed(path, info, now=None):
+    """
+    True if RotatingCsvFile is finished with the file: it has been
+    compressed, its period is over, or a later part exists.
+    """
+    if info["compressed"]:
+        return True
+    if info["end"] <= (now or datetime.now()):
+        return True
+    following = os.path.join(os.path.dirname(str(path)), "%s-%s.%d.csv" % (
+        info["date"], info["suffix"], info["part"] + 1))
+    return any(os.path.exists(following + suffix) for suffix in ("",) + COMPRESSED_SUFFIXES)
+
+
+def _float(value):
+    return float(value) if value not in (None, "") else None
+
+
+def _int(value):
+    if value in (None, ""):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        number = float(value)
+        if not number.is_integer():
+            raise
+        return int(number)
+
+
+def _timestamp(value):
+    return datetime.fromisoformat(value) if value not in (None, "") else None
+
+
+def column_types(headers, rows):
+    """
+    The arrow type of each column.  INT_COLUMNS are int64 (blanks are
+    nulls, read by pandas as the nullable Int64 with dtype_backend) if every
+    value is a whole number.  Columns not named in TIMESTAMP_COLUMNS or
+    STRING_COLUMNS are otherwise float64 if every value converts, strings if
+    not.
+    """
+    types = {}
+    for header in headers:
+        if header in TIMESTAMP_COLUMNS:
+            types[header] = pyarrow.timestamp("us")
+        elif header in STRING_COLUMNS:
+            types[header] = pyarrow.string()
+        elif header in INT_COLUMNS and _all_convert(_int, header, rows):
+            types[header] = pyarrow.int64()
+        elif _all_convert(_float, header, rows):
+            types[header] = pyarrow.float64()
+        else:
+            types[header] = pyarrow.string()
+    return types
+
+
+def _all_convert(convert, header, rows):
+    try:
+        for row in rows:
+            convert(row.get(header))
+    except ValueError:
+        return False
+    return True
+
+
+def read_rows(path):
+    """
+    Returns:
+        tuple: (headers, list of row dictionaries)
+    """
+    source = BaseCsvFile(path)
+    source.setup_read()
+    try:
+        rows = list(source.readrow())
+        headers = source.csv_handler.fieldnames or []
+    finally:
+        source.close()
+    return headers, rows
+
+
+def stream_schema(stream):
+    """
+    The fixed schema of a stream's logs ("ping", "speed" or "traceroute"),
+    from the csv headers and column types of sqlite_store.SCHEMAS, so every
+    partition of a stream has the same columns and types.
+    """
+    fields = []
+    for header, column, kind in SCHEMAS[stream][1]:
+        if column.endswith("epoch"):
+            fields.append(pyarrow.field(header, pyarrow.timestamp("us")))
+        elif kind.startswith("INTEGER"):
+            fields.append(pyarrow.field(header, pyarrow.int64()))
+        elif kind.startswith("REAL"):
+            fields.append(pyarrow.field(header, pyarrow.float64()))
+        else:
+            fields.append(pyarrow.field(header, pyarrow.string()))
+    return pyarrow.schema(fields)
+
+
+def stream_for(suffix, headers):
+    """
+    The stream of a log: from its suffix if that is a stream's default,
+    otherwise the stream whose headers it shares the most of.  None if it
+    shares none.
+    """
+    for stream, default in STREAMS.items():
+        if suffix == default:
+            return stream
+    best = None
+    shared = 0
+    for stream in STREAMS:
+        count = len(set(headers) & set(header for header, _, _ in SCHEMAS[stream][1]))
+        if count > shared:
+            best, shared = stream, count
+    return best
+
+
+def _or_null(convert, value):
+    try:
+        return convert(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_table(headers, rows, schema=None):
+    """
+    Convert csv rows to a typed pyarrow Table.  With a schema, its columns
+    are used (missing ones are all null, others are left out) and values
+    that do not convert are null, otherwise the types are inferred from the
+    rows (column_types).
+    """
+    if schema is None:
+        types = column_types(headers, rows)
+        names = list(headers)
+    else:
+        types = {field.name: field.type for field in schema}
+        names = schema.names
+    arrays = []
+    for header in names:
+        kind = types[header]
+        if kind == pyarrow.float64():
+            values = [_or_null(_float, row.get(header)) for row in rows]
+        elif kind == pyarrow.int64():
+            values = [_or_null(_int, row.get(header)) for row in rows]
+        elif pyarrow.types.is_timestamp(kind):
+            values = [_or_null(_timestamp, row.get(header)) for row in rows]
+        else:
+            values = [row.get(header) for row in rows]
+        arrays.append(pyarrow.array(values, type=kind))
+    if schema is None:
+        return pyarrow.Table.from_arrays(arrays, names=names)
+    return pyarrow.Table.from_arrays(arrays, schema=schema)
+
+
+def export_file(path, output, compression="zstd"):
+    """
+    Export one log, one Parquet file per day it has rows for, with its
+    stream's fixed schema (stream_schema), or inferred types if it is not
+    a ping, speedtest or traceroute log.
+
+    Returns:
+        list: The Parquet files written.
+    """
+    info = parse_filename(path)
+    headers, rows = read_rows(path)
+    stream = stream_for(info["suffix"], headers)
+    schema = stream_schema(stream) if stream is not None else None
+    days = {}
+    for row in rows:
+        days.setdefault((row.get("Date") or "")[:10], []).append(row)
+    name = os.path.basename(str(path))
+    stem = name[:len(name) - len(".csv" + info["compressed"])]
+    written = []
+    for day, dayRows in sorted(days.items()):
+        if not day:
+            continue
+        directory = os.path.join(output, info["suffix"], "date=%s" % day)
+        os.makedirs(directory, exist_ok=True)
+        target = os.path.join(directory, stem + ".parquet")
+        temporary = target + ".tmp"
+        pyarrow.parquet.write_table(to_table(headers, dayRows, schema), temporary,
+                                    compression=compression)
+        os.replace(temporary, target)
+        written.append(target)
+    return written
+
+
+def export_directory(directory="data", output="export", compression="zstd", now=None):
+    """
+    Export every closed log in directory that has not been exported yet (or
+    has changed since).
+
+    Returns:
+        list: The logs exported.
+
+    Raises:
+        RuntimeError: If pyarrow is not installed.
+    """
+    if pyarrow is None:
+        raise RuntimeError("Exporting to Parquet requires pyarrow.")
+    os.makedirs(output, exist_ok=True)
+    statePath = os.path.join(output, STATE_FILE)
+    state = {}
+    if os.path.exists(statePath):
+        with open(statePath) as handle:
+            state = json.load(handle)
+    exported = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        info = parse_filename(name)
+        if info is None or not is_closed(path, info, now):
+            continue
+        stat = os.stat(path)
+        # The plain file and its compressed copy are the same log
+        key = name[:len(name) - len(info["compressed"])]
+        done = state.get(key)
+        if done is not None and (info["compressed"] or
+                                 (done["size"], done["mtime"]) == (stat.st_size, stat.st_mtime)):
+            continue
+        try:
+            export_file(path, output, compression)
+        except Exception as e:
+            print("Error exporting %s: %s" % (path, e))
+            traceback.print_exc()
+            continue
+        state[key] = {"size": stat.st_size, "mtime": stat.st_mtime}
+        exported.append(path)
+        with open(statePath + ".tmp", "w") as handle:
+            json.dump(state, handle, indent=1, sort_keys=True)
+        os.replace(statePath + ".tmp", statePath)
+    return exported
+
+
+if __name__ == "__main__":
+    directory = sys.argv[1] if len(sys.argv) > 1 else "data"
+    output = sys.argv[2] if len(sys.argv) > 2 else "export"
+    start = time.perf_counter()
+    done = export_directory(directory, output)
+    print("Exported %d files in %.2f seconds" % (len(done), time.perf_counter() - start))
@@ -0,0 +1,119 @@
+"""
+Background compression of rotated log files.
+
+When RotatingCsvFile rotates, the closed file is handed to a
+BackgroundCompressor, which compresses it on its own thread so the writers
+never wait on it.  The compressed copy is written to a temporary name and
+renamed into place before the original is removed, so a reader only ever
+sees the complete plain file or the complete compressed one.
+
+gzip is always available, zstd is used if the zstandard package is
+installed (falling back to gzip if it is not).
+
+BaseCsvFile.setup_read() reads .gz and .zst files transparently.
+
+.. code-block:
+
+    from compressor import BackgroundCompressor
+    compressor = BackgroundCompressor(method="gzip")
+    logger = RotatingCsvFile(..., closed_callback=compressor.submit)
+    ...
+    compressor.close()
+"""
+import gzip
+import os
+import queue
+import shutil
+import threading
+import traceback
+
+from csv_common import KeyIndex
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+METHODS = ("gzip", "zstd")
+EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+_STOP = object()
+
+
+def compress_file(path, method="gzip", level=None):
+    """
+    Compress path to path + ".gz" (or ".zst"), then remove path and its key
+    indexes.
+
+    Returns:
+        string: The name of the compressed file, None if path no longer
+            exists (eg. it was already compressed).
+    """
+    path = str(path)
+    if not os.path.exists(path):
+        return None
+    if method == "zstd" and zstandard is None:
+        method = "gzip"
+    target = path + EXTENSIONS[method]
+    temporary = target + ".tmp"
+    with open(path, "rb") as source:
+        if method == "zstd":
+            compressor = zstandard.ZstdCompressor(level=level or 3)
+            with open(temporary, "wb") as destination:
+                compressor.copy_stream(source, destination)
+        else:
+            with gzip.open(temporary, "wb", compresslevel=level or 6) as destination:
+                shutil.copyfileobj(source, destination)
+    os.replace(temporary, target)
+    os.remove(path)
+    # Compressed files can not be indexed, the plain file's indexes are stale
+    KeyIndex.remove_indexes(path)
+    return target
+
+
+class BackgroundCompressor():
+    """
+    A thread that compresses the files it is given, one at a time.
+    """
+    def __init__(self, method="gzip", level=None):
+        """
+        Args:
+            method (string): "gzip" or "zstd"
+            level (integer): Compression level, the library default if None.
+
+        Raises:
+            ValueError: On an unknown method.
+        """
+        if method not in METHODS:
+            raise ValueError("Unknown compression method: %s" % method)
+        self.method = method
+        self.level = level
+        self.compressed = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="compressor", daemon=True)
+        self._thread.start()
+
+    def submit(self, path):
+        """
+        Queue a closed file for compression.
+        """
+        self._queue.put(str(path))
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            if path is _STOP:
+                break
+            try:
+                compress_file(path, self.method, self.level)
+                self.compressed += 1
+            except Exception as e:
+                print("Error compressing %s: %s" % (path, e))
+                traceback.print_exc()
+
+    def close(self):
+        """
+        Finish the files already queued, then stop.
+        """
+        self._queue.put(_STOP)
+        self._thread.join()
@@ -29,6 +29,24 @@ Examples:
         print ("Visit Prov Id: ", entry["VISIT_PROV_ID"])
 
 Versions:
+    v1.63 - KeyIndex.remove_indexes, for the logs that are compressed or
+            pruned
+    v1.62 - The yyyy-mm-dd fast path only accepts a valid time after the
+            date, anything else goes to dateutil as before
+    v1.61 - KeyIndex strips single column keys when indexing, as it does
+            when looking them up; older .idx files are rebuilt
+    v1.60 - mdy_to_ymd_str and mdy_to_ymd_flex_str slice fixed position
+            mm-dd-yyyy (and yyyy-mm-dd) dates directly, and cache the
+            strptime / dateutil fallback (DATE_CACHE_SIZE values)
+    v1.59 - setup_read(columns=...) projects the read to the named columns,
+            resolved from the header once (ProjectedReader)
+          - Added readtuples
+          - _read_by_key(restrictFields=...) only materializes the restricted
+            columns, rather than deleting the others from every row
+    v1.58 - Added KeyIndex, a persistent key -> byte offset index, and
+            lookup_by_key / lookup_by_keys which use it to seek to the rows
+    v1.57 - setup_read transparently reads gzip (.gz) and zstd (.zst) compressed files
+          - Added fsync to BaseCsvFile
     v1.56 - Default CSV Writer to use QUOTE_MINIMAL, controlled by quote argument
     v1.55 - Added in_sep & out_sep to mdy_to_ymd_str
           - Added out_sep to float_to_ymd_str
@@ -40,13 +58,20 @@ Versions:
 """
 __author__ = "Benjamin Schollnick"
 __status__ = "Production"
-__version__ = "1.55"
+__version__ = "1.63"
 
 
 import datetime
 import csv
+import functools
+import gzip
+import hashlib
+import io
+import json
+import operator
 import pathlib
 import os
+import re
 import sys
 
 from dateutil.parser import parse
@@ -63,6 +88,354 @@ def ensure_dirs(dpath):
     except WindowsError:
         pass
 
+COMPRESSED_SUFFIXES = (".gz", ".zst")
+
+def resolve_compressed(path):
+    """
+    Return path if it exists, otherwise the compressed (.gz / .zst) version
+    of it if that exists (eg. a rotated log that has since been compressed).
+    Otherwise path is returned unchanged.
+    """
+    path = pathlib.Path(path)
+    if path.exists():
+        return path
+    for suffix in COMPRESSED_SUFFIXES:
+        candidate = path.with_name(path.name + suffix)
+        if candidate.exists():
+            return candidate
+    return path
+
+def open_text(path, encoding=None):
+    """
+    Open a (possibly gzip or zstd compressed) file for reading as text,
+    with universal newlines disabled as the csv module expects.
+    """
+    path = pathlib.Path(path)
+    if path.suffix == ".gz":
+        return gzip.open(path, mode='rt', newline='', encoding=encoding)
+    if path.suffix == ".zst":
+        import zstandard
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(path.open(mode='rb')),
+                                newline='', encoding=encoding)
+    return path.open(mode='r', newline='', encoding=encoding)
+
+# Bumped when the saved index layout or key normalization changes
+KEY_INDEX_FORMAT = 2
+
+class KeyIndex():
+    """
+    A persistent index of a csv file: key value -> byte offset of the row.
+
+    Built in one streaming pass, and saved next to the file as
+    <file>.<hash of the key columns>.idx.  It is only reused while the
+    file's size and mtime are unchanged, otherwise it is rebuilt.  Keys are
+    stripped and upper cased (KeyIndex.normalize), both when indexed and
+    when looked up, several key columns are joined by "_" as _read_by_keys
+    does, and only the first row of each key is indexed (the later ones are
+    conflicts).
+
+    Only plain files can be indexed, compressed files can not be seeked.
+
+    .. code-block:
+
+        index = KeyIndex("data/2021-07-23-pingresults.csv", keys=["Date", "target"])
+        for row in index.rows(["2021-07-23 09:47:00.123456_8.8.8.8"]):
+            print(row)
+    """
+    def __init__(self, fqpn, keys, encoding='utf-8-sig', delimiter=','):
+        """
+        Args:
+            fqpn (string): The csv file.
+            keys (string or list): The key column, or columns.
+        """
+        self.path = pathlib.Path(fqpn)
+        self.keys = [keys] if isinstance(keys, str) else list(keys)
+        self.single = isinstance(keys, str)
+        self.encoding = encoding
+        # A BOM is only on the first line, the rows are read without it
+        self.row_encoding = 'utf-8' if encoding == 'utf-8-sig' else encoding
+        self.delimiter = delimiter
+        spec = hashlib.sha1(json.dumps(self.keys).encode("utf-8")).hexdigest()[:8]
+        self.index_path = self.path.with_name("%s.%s.idx" % (self.path.name, spec))
+        self.fieldnames = None
+        self.offsets = None
+
+    @staticmethod
+    def remove_indexes(fqpn):
+        """
+        Remove every saved index of a csv file, eg. once it is compressed or
+        pruned.
+
+        Args:
+            fqpn (string): The csv file.
+
+        Returns:
+            list: The index files removed.
+        """
+        path = pathlib.Path(fqpn)
+        prefix = path.name + "."
+        removed = []
+        if not path.parent.is_dir():
+            return removed
+        for name in os.listdir(path.parent):
+            if name.startswith(prefix) and name.endswith(".idx"):
+                try:
+                    os.remove(path.parent / name)
+                except FileNotFoundError:
+                    continue
+                removed.append(str(path.parent / name))
+        return removed
+
+    @staticmethod
+    def normalize(value):
+        """
+        The form key values are indexed and looked up in.
+        """
+        return str(value).strip().upper()
+
+    def key_value(self, row):
+        """
+        The normalized key of a row.
+        """
+        if self.single:
+            return self.normalize(row[self.keys[0]])
+        return self.normalize('_'.join(row[key].strip() for key in self.keys))
+
+    def _stamp(self):
+        stat = self.path.stat()
+        return stat.st_size, stat.st_mtime_ns
+
+    def load(self):
+        """
+        Load the saved index if it is still valid, otherwise build and save
+        it.
+
+        Returns:
+            dictionary: key value -> byte offset
+        """
+        if self.offsets is not None:
+            return self.offsets
+        size, mtime = self._stamp()
+        if self.index_path.exists():
+            try:
+                with self.index_path.open(mode='r', encoding='utf-8') as handle:
+                    saved = json.load(handle)
+                if (saved["size"], saved["mtime"], saved["keys"], saved.get("format")) == \
+                        (size, mtime, self.keys, KEY_INDEX_FORMAT):
+                    self.fieldnames = saved["fieldnames"]
+                    self.offsets = saved["offsets"]
+                    return self.offsets
+            except (ValueError, KeyError):
+                pass
+        self.build()
+        return self.offsets
+
+    def _records(self, handle):
+        """
+        Yield (byte offset, row list) for every csv record, following quoted
+        fields over several lines.
+        """
+        position = [handle.tell()]
+        def lines():
+            encoding = self.encoding if position[0] == 0 else self.row_encoding
+            for line in handle:
+                position[0] += len(line)
+                yield line.decode(encoding)
+                encoding = self.row_encoding
+        reader = csv.reader(lines(), delimiter=self.delimiter)
+        while True:
+            start = position[0]
+            try:
+                record = next(reader)
+            except StopIteration:
+                return
+            yield start, record
+
+    def build(self):
+        """
+        Index the file in one streaming pass, and save the index.
+        """
+        size, mtime = self._stamp()
+        offsets = {}
+        with self.path.open(mode='rb') as handle:
+            records = self._records(handle)
+            try:
+                self.fieldnames = next(records)[1]
+            except StopIteration:
+                self.fieldnames = []
+            for offset, record in records:
+                if not record:
+                    continue
+                keyvalue = self.key_value(dict(zip(self.fieldnames, record)))
+                if keyvalue not in offsets:
+                    offsets[keyvalue] = offset
+        self.offsets = offsets
+        temporary = self.index_path.with_name(self.index_path.name + ".tmp")
+        with temporary.open(mode='w', encoding='utf-8') as handle:
+            json.dump({"format": KEY_INDEX_FORMAT, "size": size, "mtime": mtime,
+                       "keys": self.keys, "fieldnames": self.fieldnames,
+                       "offsets": offsets}, handle)
+        os.replace(str(temporary), str(self.index_path))
+
+    def rows(self, keyvalues):
+        """
+        Seek to, and read, the rows of the given key values.  Values that are
+        not in the file are skipped.
+
+        Yields:
+            tuple: (key value, row dictionary)
+        """
+        offsets = self.load()
+        with self.path.open(mode='rb') as handle:
+            for keyvalue in keyvalues:
+                keyvalue = self.normalize(keyvalue)
+                if keyvalue not in offsets:
+                    continue
+                handle.seek(offsets[keyvalue])
+                lines = (line.decode(self.row_encoding) for line in handle)
+                record = next(csv.reader(lines, delimiter=self.delimiter))
+                yield keyvalue, dict(zip(self.fieldnames, record))
+
+class ProjectedReader():
+    """
+    Iterate a csv.reader, returning only the chosen columns of each row.
+
+    The column positions are resolved from the header once, so each row is
+    one itemgetter call, rather than a dictionary of every column.
+    """
+    def __init__(self, reader, fieldnames, columns):
+        """
+        Args:
+            reader (csv.reader): Positioned after the header.
+            fieldnames (list): The header.
+            columns (list): The columns wanted, matched exactly, or else
+                case-insensitively.
+
+        Raises:
+            RuntimeError: If a column is not in the header.
+        """
+        self.reader = reader
+        self.fieldnames = list(columns)
+        lowered = [str(name).lower() for name in fieldnames]
+        self.positions = []
+        for column in self.fieldnames:
+            if column in fieldnames:
+                self.positions.append(fieldnames.index(column))
+            elif str(column).lower() in lowered:
+                self.positions.append(lowered.index(str(column).lower()))
+            else:
+                raise RuntimeError("Column %s is not in the file." % column)
+        self._getter = operator.itemgetter(*self.positions) if self.positions else None
+        self._single = len(self.positions) == 1
+
+    @property
+    def line_num(self):
+        return self.reader.line_num
+
+    def next_tuple(self):
+        """
+        The next row's chosen columns as a tuple.  Blank lines are skipped,
+        columns missing from a short row are None.
+        """
+        row = next(self.reader)
+        while row == []:
+            row = next(self.reader)
+        if self._getter is None:
+            return ()
+        try:
+            values = self._getter(row)
+        except IndexError:
+            return tuple(row[position] if position < len(row) else None
+                         for position in self.positions)
+        return (values,) if self._single else values
+
+    def tuples(self):
+        while True:
+            try:
+                yield self.next_tuple()
+            except StopIteration:
+                return
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return dict(zip(self.fieldnames, self.next_tuple()))
+
+# The distinct date strings remembered by the date conversion fallbacks
+DATE_CACHE_SIZE = 4096
+
+# The time _sliced_iso accepts after a yyyy-mm-dd date
+_iso_time = re.compile(r"[ T](\d{2}):(\d{2})(?::(\d{2})(?:\.\d+)?)?$")
+
+def _sliced_mdy(value, sep):
+    """
+    mm<sep>dd<sep>yyyy by position.
+
+    Returns:
+        datetime.date: None if value does not have that layout, or is not a
+            valid date.
+    """
+    if len(value) == 10 and value[2] == sep and value[5] == sep:
+        digits = value[0:2] + value[3:5] + value[6:10]
+        if digits.isdigit() and digits.isascii():
+            try:
+                return datetime.date(int(digits[4:8]), int(digits[0:2]), int(digits[2:4]))
+            except ValueError:
+                return None
+    return None
+
+def _sliced_iso(value):
+    """
+    yyyy-mm-dd, optionally followed by " " or "T" and a valid hh:mm[:ss[.f]]
+    time, by position.
+
+    Returns:
+        datetime.date: None if value does not have that layout, or is not a
+            valid date and time.
+    """
+    if len(value) >= 10 and value[4] == "-" and value[7] == "-":
+        if len(value) > 10:
+            clock = _iso_time.match(value, 10)
+            if clock is None or int(clock.group(1)) > 23 or int(clock.group(2)) > 59 or \
+                    int(clock.group(3) or 0) > 59:
+                return None
+        digits = value[0:4] + value[5:7] + value[8:10]
+        if digits.isdigit() and digits.isascii():
+            try:
+                return datetime.date(int(digits[0:4]), int(digits[4:6]), int(digits[6:8]))
+            except ValueError:
+                return None
+    return None
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def _strptime_mdy(value, sep):
+    try:
+        return datetime.datetime.strptime(value, "%m{}%d{}%Y".format(sep, sep)).date()
+    except ValueError:
+        return None
+
+@functools.lru_cache(maxsize=8)
+def _parser_20c(default_yr):
+    from dateutil.parser import parserinfo, parser
+    class parserinfo_20c(parserinfo):
+        def convertyear(self, year, century_specified=False):
+            if not century_specified and year < 100:
+                year += default_yr
+            return year
+
+    return parser(parserinfo_20c())
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def _parse_flex(value, yearFirst, dayFirst, default_yr):
+    try:
+        return _parser_20c(default_yr).parse(value, yearfirst=yearFirst, dayfirst=dayFirst).date()
+    except ParserError:
+        return None
+
+def _ymd(date, sep):
+    return "%s%s%02d%s%02d" % (date.year, sep, date.month, sep, date.day)
+
 def force_add_seps(datestring, sep="-"):
     """Must be yyyymmdd
 
@@ -108,11 +481,10 @@ def mdy_to_ymd_str(mdy, in_sep="-", out_sep="-"):
     """
     output = ""
     if mdy not in [None, ""]:
-        try:
-            output = datetime.datetime.strptime(mdy, "%m{}%d{}%Y".format(in_sep, in_sep))
-            output = output.strftime("%Y{}%m{}%d".format(out_sep, out_sep))
-        except ValueError:
+        date = _sliced_mdy(mdy, in_sep) or _strptime_mdy(mdy, in_sep)
+        if date is None:
             return None
+        output = _ymd(date, out_sep)
     return output
 
 def mdy_to_ymd_flex_str(mdy, in_sep=r"-", out_sep="-", yearFirst=False, dayFirst=False, reject_blank=False, default_yr=2000):
@@ -154,26 +526,21 @@ def mdy_to_ymd_flex_str(mdy, in_sep=r"-", out_sep="-", yearFirst=False, dayFirst
     '2019/08/24'
     """
 
-    from dateutil.parser import parserinfo, parser
-    class parserinfo_20c(parserinfo):
-        def convertyear(self, year, century_specified=False):
-            if not century_specified and year < 100:
-                year += default_yr
-            return year
-
-    parser_20c = parser(parserinfo_20c())
-
-    def parse_20c(timestr, **kwargs):
-        return parser_20c.parse(timestr, **kwargs)
             # mm-dd-yyyy    # 10    -> mmddyyyy     # 8
             # mm-dd-yy      # 8     -> mmddyy       # 6
             # mmddyy        # 6     -> mmddyy       # 6
 
     mdy = mdy.replace(in_sep, "-")
     if mdy not in [None, ""]:
-        try:
-            mdy = parse_20c(mdy, yearfirst=yearFirst, dayfirst=dayFirst).strftime("%Y{}%m{}%d".format(out_sep, out_sep)) # if out_seps requested, they are added.
-        except ParserError:
+        date = None
+        if not dayFirst:
+            # dateutil reads both of these the same way, unless dayfirst is set
+            date = _sliced_iso(mdy) or _sliced_mdy(mdy, "-")
+        if date is None:
+            date = _parse_flex(mdy, yearFirst, dayFirst, default_yr)
+        if date is not None:
+            mdy = _ymd(date, out_sep) # if out_seps requested, they are added.
+        else:
             mdy = False
             print("Parser Error")
             if reject_blank:
@@ -266,7 +633,7 @@ class BaseCsvFile():
             self.__fh.close()
 
     def setup_read(self, delimiter=',', force_headers=False,
-                   remap_source=False, encoding='utf-8-sig'):
+                   remap_source=False, encoding='utf-8-sig', columns=None):
         """
         Configure for Read only.
 
@@ -282,6 +649,10 @@ class BaseCsvFile():
                 remap is intended, pass the function you wish to act as the file
                 handle.  (Generally used for Memory IO, instead of File IO)
 
+            columns (list): If set, only these columns are read.  readrow,
+                readrawline and the keyed readers then only return these
+                columns, and readtuples returns them as tuples.
+
         Returns:
             Boolean: True if successfully set, False if bad headers, or
                 File doesn't exist.
@@ -306,21 +677,29 @@ class BaseCsvFile():
         elif self.writing:
             raise RuntimeError("Configured for Writing - unable to Read.")
 
+        self.path = resolve_compressed(self.path)
         if self.path.exists() is False:
             raise RuntimeError("File Does not Exist")
             #return False
 
-        if encoding == None:
-            self.__fh = self.path.open(mode='r', newline='')
-        else:
-            self.__fh = self.path.open(mode='r', newline='', encoding=encoding)
+        self.__fh = open_text(self.path, encoding=encoding)
 
         if remap_source:
             self.source = remap_source(self.__fh)
         else:
             self.source = self.__fh
 
-        if force_headers:
+        if columns is not None:
+            reader = csv.reader(self.source,
+                                delimiter=delimiter,
+                                quoting=self.quoting,
+                                lineterminator=self.lineterm)
+            if force_headers:
+                fieldnames = list(self.input_headers)
+            else:
+                fieldnames = next(reader, [])
+            self.csv_handler = ProjectedReader(reader, fieldnames, columns)
+        elif force_headers:
             self.csv_handler = csv.DictReader(self.source,
                                               delimiter=delimiter,
                                               fieldnames=self.input_headers,
@@ -455,6 +834,14 @@ class BaseCsvFile():
     def flush(self):
         self.__fh.flush()
 
+    def fsync(self):
+        """
+        Flush, and ask the OS to commit the file to disk.
+        """
+        if self.__fh != None and not self.__fh.closed:
+            self.__fh.flush()
+            os.fsync(self.__fh.fileno())
+
     def return_beginning(self):
         """
         Forcibly reset the file offset pointer to the beginning of the file.
@@ -523,6 +910,21 @@ class BaseCsvFile():
         """
         return datadict
 
+    def readtuples(self):
+        """
+        Read the rows as tuples of the columns given to setup_read(columns=),
+        the cheapest way to read a few columns of a wide file.
+
+        Yield:
+            tuple: The values, in the order of the columns.
+
+        Raises:
+            RuntimeError: if not set up to read with columns.
+        """
+        if not self.reading or not isinstance(self.csv_handler, ProjectedReader):
+            raise RuntimeError('Attempted to read tuples without setup_read(columns=...)')
+        return self.csv_handler.tuples()
+
     def readrawline(self, clean_func=None):
         """
         Allow manual loading of the file, line by line as a generator.
@@ -709,6 +1111,22 @@ class BaseCsvFile():
         self.conflictCount = 0
         if key is None:
             raise RuntimeError("No key specified.")
+        if restrictFields is not None and clean_func is None and \
+                isinstance(self.csv_handler, csv.DictReader):
+            # Only materialize the restricted columns, and the key
+            fieldnames = self.csv_handler.fieldnames or []
+            keep = [name for name in fieldnames if name.title() in restrictFields]
+            projected = ProjectedReader(self.csv_handler.reader, fieldnames, keep + [key])
+            for values in projected.tuples():
+                keyvalue = str(values[-1]).upper()
+                if keyvalue in data:
+                    self.conflictCount += 1
+                    if revealConflicts:
+                        print("Conflict: ", keyvalue)
+                else:
+                    data[keyvalue] = dict(zip(keep, values))
+                    self.readCount += 1
+            return data
         for row in self.csv_handler:
             if clean_func is not None:
                 row = clean_func(row)
@@ -826,3 +1244,149 @@ class BaseCsvFile():
 
     read_by_key = _read_by_key
     read_by_keys = _read_by_keys
+
+    def lookup_by_key(self, key, values, clean_func=None):
+        """
+        Like _read_by_key, but only returns the rows of the given key values,
+        seeking straight to them through a persistent KeyIndex (built on the
+        first call, and reused until the file changes).  Compressed files are
+        scanned instead.
+
+        Args:
+            key (string): The key column.
+            values (list): The key values wanted.
+            clean_func (func): Applied to each returned row.  The key is
+                taken from the row *before* cleaning.
+
+        Returns:
+            Dictionary: key value -> row, for the values found.
+        """
+        return self._lookup(key, values, clean_func)
+
+    def lookup_by_keys(self, keys, values, clean_func=None):
+        """
+        Like _read_by_keys, but only returns the rows of the given key
+        values (the key columns joined by "_"), see lookup_by_key.
+        """
+        return self._lookup(list(keys), values, clean_func)
+
+    def _lookup(self, keys, values, clean_func):
+        path = resolve_compressed(self.path)
+        index = KeyIndex(path, keys)
+        data = {}
+        if path.suffix in COMPRESSED_SUFFIXES:
+            wanted = set(KeyIndex.normalize(value) for value in values)
+            with open_text(path, encoding='utf-8-sig') as handle:
+                for row in csv.DictReader(handle):
+                    keyvalue = index.key_value(row)
+                    if keyvalue in wanted and keyvalue not in data:
+                        data[keyvalue] = row
+        else:
+            data = dict(index.rows(values))
+        if clean_func is not None:
+            data = {keyvalue: clean_func(row) for keyvalue, row in data.items()}
+        self.readCount = len(data)
+        return data
+
+
+if __name__ == "__main__":
+    # Benchmarks of column projection on a wide file, and of the date
+    # conversions: python csv_common.py [rows] [columns]
+    import tempfile
+    import time
+    import tracemalloc
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    headers = ["Column%d" % number for number in range(width)]
+    wanted = ["Column0", "Column7", "Column42"]
+
+    def measure(label, read):
+        start = time.perf_counter()
+        read()
+        elapsed = time.perf_counter() - start
+        # tracemalloc slows the run down, so time and measure separately
+        tracemalloc.start()
+        kept = read()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("%-34s %6.2f seconds  %7.1f MB peak" % (label, elapsed, peak / 1024.0 / 1024.0))
+        return kept
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "wide.csv")
+        with open(path, "w", newline="") as handle:
+            writer = csv.writer(handle, quoting=csv.QUOTE_ALL, lineterminator="\n")
+            writer.writerow(headers)
+            for count in range(rows):
+                writer.writerow(["%d-%d" % (count, column) for column in range(width)])
+
+        def full_rows():
+            source = BaseCsvFile(path)
+            source.setup_read()
+            return [{name: row[name] for name in wanted} for row in source.readrow()]
+
+        def projected_rows():
+            source = BaseCsvFile(path)
+            source.setup_read(columns=wanted)
+            return list(source.readrow())
+
+        def projected_tuples():
+            source = BaseCsvFile(path)
+            source.setup_read(columns=wanted)
+            return list(source.readtuples())
+
+        def restricted_old():
+            source = BaseCsvFile(path)
+            source.setup_read()
+            # a clean_func takes the original, delete the other keys, path
+            return source.read_by_key("Column0", restrictFields=["Column7", "Column42"],
+                                      clean_func=lambda row: row)
+
+        def restricted_new():
+            source = BaseCsvFile(path)
+            source.setup_read()
+            return source.read_by_key("Column0", restrictFields=["Column7", "Column42"])
+
+        assert full_rows() == projected_rows()
+        assert restricted_old() == restricted_new()
+        measure("readrow, DictReader", full_rows)
+        measure("readrow, setup_read(columns=)", projected_rows)
+        measure("readtuples", projected_tuples)
+        measure("read_by_key(restrictFields), old", restricted_old)
+        measure("read_by_key(restrictFields), new", restricted_new)
+
+    def legacy_mdy_to_ymd_str(mdy, in_sep="-", out_sep="-"):
+        output = datetime.datetime.strptime(mdy, "%m{}%d{}%Y".format(in_sep, in_sep))
+        return output.strftime("%Y{}%m{}%d".format(out_sep, out_sep))
+
+    def legacy_flex(mdy, default_yr=2000):
+        from dateutil.parser import parserinfo, parser
+        class parserinfo_20c(parserinfo):
+            def convertyear(self, year, century_specified=False):
+                if not century_specified and year < 100:
+                    year += default_yr
+                return year
+        return parser(parserinfo_20c()).parse(mdy).strftime("%Y-%m-%d")
+
+    # A date column repeats a few thousand distinct values
+    first = datetime.datetime(2019, 1, 1)
+    days = [first + datetime.timedelta(days=count % 2000, seconds=count * 7) for count in range(rows)]
+    columns = {"mm-dd-yyyy": [day.strftime("%m-%d-%Y") for day in days],
+               "log Date (iso)": [str(day) for day in days],
+               "mm/dd/yy": [day.strftime("%m/%d/%y") for day in days]}
+    print()
+    for label, legacy, current, values in [
+            ("mdy_to_ymd_str", legacy_mdy_to_ymd_str, mdy_to_ymd_str, columns["mm-dd-yyyy"]),
+            ("mdy_to_ymd_flex_str", legacy_flex, mdy_to_ymd_flex_str, columns["mm-dd-yyyy"]),
+            ("mdy_to_ymd_flex_str", legacy_flex, mdy_to_ymd_flex_str, columns["log Date (iso)"]),
+            ("mdy_to_ymd_flex_str", legacy_flex, mdy_to_ymd_flex_str, columns["mm/dd/yy"])]:
+        layout = [name for name, column in columns.items() if column is values][0]
+        start = time.perf_counter()
+        before = [legacy(value) for value in values]
+        old = time.perf_counter() - start
+        start = time.perf_counter()
+        after = [current(value) for value in values]
+        new = time.perf_counter() - start
+        assert before == after, label
+        print("%-20s %-15s %9d/second  ->  %9d/second" % (label, layout, rows / old, rows / new))
@@ -0,0 +1,141 @@
+"""
+Batched multi-target ping through a single fping process.
+
+Rather than one ``ping`` child per target, every target of a sweep is handed
+to one ``fping -C <count> -q`` process and its combined per-target output is
+parsed in a single pass.  Useful where ICMP sockets are not available to
+speedcomplainer itself (see icmp_ping.py).
+
+fping -C writes one line per target to stderr, listing the RTT of each probe
+in milliseconds, or "-" for a lost probe:
+
+.. code-block:
+
+    8.8.8.8     : 21.30 22.10 - 23.00 21.95
+    10.0.0.99   : - - - - -
+    bogus.host: Name or service not known
+
+The results have the same keys as PingTest.doPingTest, so they produce the
+same csv_ping_headers rows.
+
+Benchmark (spawn count and wall time) against the per-target path:
+
+    python fping_ping.py 8.8.8.8 1.1.1.1 9.9.9.9
+"""
+import re
+import subprocess
+import sys
+import time
+
+from icmp_ping import summarise
+
+_fping_line = re.compile(r"^(\S+)[ \t]*:[ \t]*((?:(?:[\d.]+|-)[ \t]*)+)$", re.MULTILINE)
+
+
+def parse_fping_output(output, targets, count, startNs=None, interval=1.0):
+    """
+    Parse the combined ``fping -C`` output.
+
+    Args:
+        output (string): fping's stderr.
+        targets (list): The targets that were pinged, targets missing from the
+            output (eg. unresolvable names) are reported with 100% loss.
+        count (integer): Number of probes sent to each target.
+        startNs (integer): time.monotonic_ns() when fping was started.  If
+            given, the individual probes are returned under "samples", with
+            their send times estimated from the probe interval.
+        interval (float): Seconds between probes to the same target.
+
+    Returns:
+        list: One result dictionary per target, in the order given.
+
+    >>> rows = parse_fping_output("1.1.1.1 : 1.00 - 3.00\\n", ["1.1.1.1"], 3)
+    >>> rows[0]["Received"], rows[0]["Packet Loss #"], rows[0]["Avg"]
+    (2, 1, 2.0)
+    """
+    probes = {}
+    for host, values in _fping_line.findall(output):
+        probes[host] = [None if value == "-" else float(value) for value in values.split()]
+    output = []
+    for target in targets:
+        values = probes.get(target, [None] * count)
+        samples = None
+        if startNs is not None:
+            samples = [(startNs + int(index * interval * 1e9), rtt)
+                       for index, rtt in enumerate(values)]
+        output.append(summarise(target, count, [rtt for rtt in values if rtt is not None],
+                                samples))
+    return output
+
+
+class FpingTransmitter():
+    """
+    Pings a list of targets from one fping child process per sweep.
+    """
+    def __init__(self, count=5, timeout=4, interval=1.0, command="fping"):
+        """
+        Args:
+            count (integer): Probes sent to each target.
+            timeout (float): Seconds to wait for each reply.
+            interval (float): Seconds between probes to the same target.
+            command (string): The fping executable.
+        """
+        self.count = count
+        self.timeout = timeout
+        self.interval = interval
+        self.command = command
+        self.spawnCount = 0
+
+    def commandline(self, targets):
+        return [self.command, "-q",
+                "-C", str(self.count),
+                "-t", str(int(self.timeout * 1000)),
+                "-p", str(int(self.interval * 1000))] + list(targets)
+
+    def ping(self, targets):
+        """
+        Ping every target.
+
+        Returns:
+            list: One result dictionary per target, in the order given.
+
+        Raises:
+            FileNotFoundError: If fping is not installed.
+        """
+        self.spawnCount += 1
+        startNs = time.monotonic_ns()
+        # fping exits non-zero when any target is unreachable, that is
+        # reported in the per target lines, so the return code is ignored.
+        completed = subprocess.run(self.commandline(targets),
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE,
+                                   universal_newlines=True)
+        return parse_fping_output(completed.stderr, targets, self.count,
+                                  startNs=startNs, interval=self.interval)
+
+
+if __name__ == "__main__":
+    targets = sys.argv[1:] or ["8.8.8.8", "1.1.1.1", "9.9.9.9"]
+    count = 3
+    transmitter = FpingTransmitter(count=count, timeout=2, interval=0.5)
+    start = time.perf_counter()
+    try:
+        transmitter.ping(targets)
+    except FileNotFoundError:
+        print("fping is not installed")
+    else:
+        print("fping:       %d targets in %.2fs, %d process(es)" % (len(targets),
+              time.perf_counter() - start, transmitter.spawnCount))
+    try:
+        import pingparsing
+    except ImportError:
+        print("pingparsing not installed, skipping the per target benchmark")
+        sys.exit()
+    start = time.perf_counter()
+    for target in targets:
+        sender = pingparsing.PingTransmitter()
+        sender.destination = target
+        sender.count = count
+        pingparsing.PingParsing().parse(sender.ping())
+    print("pingparsing: %d targets in %.2fs, %d process(es)" % (len(targets),
+          time.perf_counter() - start, len(targets)))
@@ -0,0 +1,267 @@
+"""
+In-process asyncio ICMP echo engine.
+
+Instead of forking the system ping binary once per target and parsing its
+text output, IcmpPinger sends the echo requests for every target from a
+single ICMP socket and matches the replies by sequence number.
+
+An unprivileged ICMP datagram socket (``socket(AF_INET, SOCK_DGRAM,
+IPPROTO_ICMP)``) is used where the OS allows it (Linux with a suitable
+net.ipv4.ping_group_range, macOS).  If that is refused a raw socket is tried,
+which needs root.  If neither can be opened, ping() raises OSError and the
+caller should fall back to the subprocess (pingparsing) path.
+
+Only IPv4 targets are supported.
+
+The returned dictionaries have the same keys as PingTest.doPingTest:
+
+.. code-block:
+
+    import asyncio
+    from icmp_ping import IcmpPinger
+    pinger = IcmpPinger(count=5, timeout=4)
+    for result in asyncio.run(pinger.ping(["8.8.8.8", "1.1.1.1"])):
+        print(result["target"], result["Received"], result["Avg"])
+
+Benchmark against the pingparsing path:
+
+    python icmp_ping.py 8.8.8.8 1.1.1.1 9.9.9.9
+"""
+import asyncio
+import itertools
+import os
+import socket
+import struct
+import sys
+import time
+from datetime import datetime
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+PAYLOAD = bytes(range(56))
+
+
+def checksum(data):
+    """
+    Internet checksum (RFC 1071) of data.
+    """
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack("!%dH" % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def build_echo_request(ident, seq, payload=PAYLOAD):
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    csum = checksum(header + payload)
+    return struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, csum, ident, seq) + payload
+
+
+def open_icmp_socket():
+    """
+    Returns:
+        tuple: (socket, raw) where raw is True if a raw socket had to be
+            used (replies then include the IP header).
+
+    Raises:
+        OSError: If no ICMP socket can be opened.
+    """
+    try:
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                             socket.IPPROTO_ICMP), False
+    except OSError:
+        return socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                             socket.IPPROTO_ICMP), True
+
+
+def icmp_available():
+    """
+    Returns:
+        Boolean: True if an ICMP socket can be opened by this process.
+    """
+    try:
+        sock, _ = open_icmp_socket()
+    except OSError:
+        return False
+    sock.close()
+    return True
+
+
+def summarise(target, sent, rtts, samples=None):
+    """
+    Build a csv_ping_headers style result from a list of RTTs (ms).
+
+    If samples, the individual (send time monotonic ns, rtt ms or None)
+    probes, are given they are passed along under "samples" for the
+    RttStore.  PingTest.logPingResults removes them before the CSV row is
+    written.
+    """
+    received = len(rtts)
+    result = {'Date': datetime.now(),
+            'target': target,
+            'Success': received,
+            'Packet Loss #': sent - received,
+            'Min': min(rtts) if rtts else None,
+            'Max': max(rtts) if rtts else None,
+            'Avg': sum(rtts) / received if rtts else None,
+            'Sent': sent,
+            'Received': received}
+    if samples is not None:
+        result['samples'] = samples
+    return result
+
+
+class IcmpPinger():
+    """
+    Multiplexes echo requests to many targets over one ICMP socket.
+    """
+    def __init__(self, count=5, timeout=4, interval=1.0):
+        """
+        Args:
+            count (integer): Echo requests sent to each target.
+            timeout (float): Seconds to wait for replies after the last
+                request has been sent.
+            interval (float): Seconds between rounds of requests.
+        """
+        self.count = count
+        self.timeout = timeout
+        self.interval = interval
+        self.ident = os.getpid() & 0xffff
+        self._sequence = itertools.count()
+
+    async def _resolve(self, loop, target):
+        try:
+            info = await loop.getaddrinfo(target, None, family=socket.AF_INET,
+                                          type=socket.SOCK_DGRAM)
+        except socket.gaierror:
+            return None
+        return info[0][4][0]
+
+    async def ping(self, targets):
+        """
+        Ping every target count times.
+
+        Args:
+            targets (list): Host names or IPv4 addresses.
+
+        Returns:
+            list: One result dictionary per target, in the order given.
+
+        Raises:
+            OSError: If no ICMP socket could be opened.
+        """
+        loop = asyncio.get_running_loop()
+        sock, raw = open_icmp_socket()
+        sock.setblocking(False)
+        addresses = await asyncio.gather(*[self._resolve(loop, target)
+                                           for target in targets])
+        sent = dict.fromkeys(targets, 0)
+        rtts = {target: [] for target in targets}
+        probes = {target: [] for target in targets}
+        outstanding = {}
+        finished = asyncio.Event()
+        sending = True
+
+        def on_readable():
+            while True:
+                try:
+                    data, source = sock.recvfrom(2048)
+                except (BlockingIOError, InterruptedError):
+                    break
+                received_ns = time.monotonic_ns()
+                if raw:
+                    data = data[(data[0] & 0x0f) * 4:]
+                if len(data) < 8:
+                    continue
+                icmp_type, _, _, ident, seq = struct.unpack("!BBHHH", data[:8])
+                if icmp_type != ICMP_ECHO_REPLY or (raw and ident != self.ident):
+                    continue
+                entry = outstanding.get(seq)
+                if entry is None or entry[1] != source[0]:
+                    continue
+                del outstanding[seq]
+                target, _, sent_ns, probe = entry
+                rtt = (received_ns - sent_ns) / 1e6
+                rtts[target].append(rtt)
+                probe[1] = rtt
+            if not sending and not outstanding:
+                finished.set()
+
+        loop.add_reader(sock.fileno(), on_readable)
+        try:
+            for count in range(self.count):
+                for target, address in zip(targets, addresses):
+                    sent[target] += 1
+                    probe = [time.monotonic_ns(), None]
+                    probes[target].append(probe)
+                    if address is None:
+                        continue
+                    seq = next(self._sequence) & 0xffff
+                    outstanding[seq] = (target, address, probe[0], probe)
+                    try:
+                        sock.sendto(build_echo_request(self.ident, seq), (address, 0))
+                    except OSError:
+                        del outstanding[seq]
+                if count < self.count - 1:
+                    await asyncio.sleep(self.interval)
+            sending = False
+            if outstanding:
+                try:
+                    await asyncio.wait_for(finished.wait(), self.timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            loop.remove_reader(sock.fileno())
+            sock.close()
+
+        return [summarise(target, sent[target], rtts[target],
+                          [tuple(probe) for probe in probes[target]])
+                for target in targets]
+
+
+def subprocess_ping(targets, count=5):
+    """
+    The pingparsing path used by PingTest, one ping process per target.
+    Used for the benchmark below.
+    """
+    import pingparsing
+    output = []
+    for target in targets:
+        transmitter = pingparsing.PingTransmitter()
+        transmitter.destination = target
+        transmitter.count = count
+        results = pingparsing.PingParsing().parse(transmitter.ping()).as_dict()
+        output.append({'Date': datetime.now(),
+                       'target': target,
+                       'Success': results["packet_receive"],
+                       'Packet Loss #': results["packet_loss_count"],
+                       'Min': results["rtt_min"],
+                       'Max': results["rtt_max"],
+                       'Avg': results["rtt_avg"],
+                       'Sent': results["packet_transmit"],
+                       'Received': results["packet_receive"]})
+    return output
+
+
+if __name__ == "__main__":
+    targets = sys.argv[1:] or ["8.8.8.8", "1.1.1.1", "9.9.9.9"]
+    count = 3
+    start = time.perf_counter()
+    try:
+        results = asyncio.run(IcmpPinger(count=count, timeout=2).ping(targets))
+    except OSError as e:
+        print("ICMP sockets unavailable: %s" % e)
+    else:
+        print("asyncio ICMP: %d targets in %.2fs" % (len(targets), time.perf_counter() - start))
+        for result in results:
+            print("\t%s received %s avg %s" % (result["target"], result["Received"], result["Avg"]))
+    start = time.perf_counter()
+    try:
+        results = subprocess_ping(targets, count=count)
+    except ImportError:
+        print("pingparsing not installed, skipping the subprocess benchmark")
+    else:
+        print("pingparsing:  %d targets in %.2fs (%d processes)" % (len(targets),
+              time.perf_counter() - start, len(targets)))
@@ -0,0 +1,265 @@
+"""
+Follow a rotated result log as it is written.
+
+A LogFollower remembers the file it is reading and the byte offset it has
+read up to, and each poll() returns only the rows appended since, so a live
+view never re-reads a whole file.  Only complete rows are returned: a row
+the writer has only partly flushed (including a quoted field that runs over
+several lines, eg. a traceroute capture) is left for the next poll.
+
+Once RotatingCsvFile has moved on to the next file (the next period of its
+filename_template, or the next part), the rest of the old file is read and
+the follower carries on from the start of the new one.  A file compressed
+or pruned in the meantime is read through its compressed copy, or skipped.
+
+The file and offset are saved in a checkpoint file after every poll that
+moved them, so a restarted follower resumes where it stopped rather than
+rescanning.  Without a checkpoint it starts at the end of the newest file,
+returning only the rows written from then on, unless fromStart asks for a
+replay of every file kept.  Either way a poll returns at most maxRows rows,
+the rest are left for the next ones.
+
+.. code-block:
+
+    from log_follower import LogFollower
+    follower = LogFollower("ping", checkpoint="data/live-ping.checkpoint")
+    for row in follower.follow(interval=1.0):
+        print(row["Date"], row["target"], row["Avg"])
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import time
+
+from csv_common import resolve_compressed
+from log_query import STREAMS, get_manifest
+from rotating_csv import parse_filename
+
+READ_SIZE = 1024 * 1024
+
+
+def _open_binary(path):
+    if path.suffix == ".gz":
+        return gzip.open(path, mode="rb")
+    if path.suffix == ".zst":
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(path.open(mode="rb"))
+    return path.open(mode="rb")
+
+
+def _skip(handle, offset):
+    # Compressed streams can only be read forward
+    if offset:
+        try:
+            handle.seek(offset)
+        except (OSError, io.UnsupportedOperation):
+            while offset > 0:
+                skipped = len(handle.read(min(offset, READ_SIZE)))
+                if not skipped:
+                    break
+                offset -= skipped
+
+
+def complete_records(data):
+    """
+    Split bytes into the complete csv records they hold.  A record ends at a
+    newline outside quotes (an even number of quote characters so far).
+
+    Returns:
+        tuple: (list of records, number of bytes they use)
+
+    >>> complete_records(b'"a","b"\\n"c","d\\n e"\\n"f","g')
+    ([b'"a","b"\\n', b'"c","d\\n e"\\n'], 19)
+    """
+    records = []
+    start = position = quotes = 0
+    while True:
+        end = data.find(b"\n", position)
+        if end == -1:
+            break
+        quotes += data.count(b'"', position, end)
+        position = end + 1
+        if quotes % 2 == 0:
+            records.append(data[start:position])
+            start = position
+            quotes = 0
+    return records, start
+
+
+class LogFollower():
+    """
+    Return the rows appended to a rotated log, across rotations.
+    """
+    def __init__(self, stream, directory="data", checkpoint=None, suffix=None,
+                 fromStart=False, maxRows=10000):
+        """
+        Args:
+            stream (string): "ping", "speed", "traceroute" or a log suffix.
+            directory (string): Where the logs are.
+            checkpoint (string): The checkpoint file, not persisted if None.
+            suffix (string): The log suffix, if not the stream's default.
+            fromStart (boolean): Without a checkpoint, replay the rows of
+                every file kept rather than start at the end of the newest.
+            maxRows (integer): The most rows a poll returns, None for no
+                limit.
+        """
+        self.suffix = suffix or STREAMS.get(stream, stream)
+        self.directory = directory
+        self.checkpoint = checkpoint
+        self.fromStart = fromStart
+        self.maxRows = maxRows
+        # Whether the first poll skips the rows already written
+        self._skipWritten = not fromStart
+        self.current = None
+        self.offset = 0
+        self.header = None
+        if checkpoint is not None and os.path.exists(checkpoint):
+            try:
+                with open(checkpoint) as handle:
+                    saved = json.load(handle)
+                self.current = saved["file"]
+                self.offset = saved["offset"]
+                self.header = saved["header"]
+            except (ValueError, KeyError):
+                self.current = None
+
+    def save(self):
+        """
+        Write the checkpoint.
+        """
+        if self.checkpoint is None:
+            return
+        temporary = self.checkpoint + ".tmp"
+        with open(temporary, "w") as handle:
+            json.dump({"file": self.current, "offset": self.offset, "header": self.header}, handle)
+        os.replace(temporary, self.checkpoint)
+
+    def _files(self):
+        # The log's files, oldest first, as plain names
+        names = []
+        for path in get_manifest(self.directory).files(self.suffix):
+            name = os.path.basename(path)
+            info = parse_filename(name)
+            names.append(name[:len(name) - len(info["compressed"])])
+        return names
+
+    def _next_file(self, files):
+        # The first file after the current one
+        if self.current is None:
+            return files[0] if files else None
+        if self.current in files:
+            index = files.index(self.current) + 1
+            return files[index] if index < len(files) else None
+        # The current file has been pruned, carry on with the next one
+        current = parse_filename(self.current)
+        for name in files:
+            info = parse_filename(name)
+            if (info["start"], info["part"]) > (current["start"], current["part"]):
+                return name
+        return None
+
+    def _read_new(self, limit=None, skip=False):
+        """
+        The complete rows appended to the current file since offset, at most
+        limit of them.  With skip, they are only read past.
+        """
+        path = resolve_compressed(os.path.join(self.directory, self.current))
+        if not path.exists():
+            return []
+        if self.header is None or (path.suffix not in (".gz", ".zst")
+                                   and path.stat().st_size < self.offset):
+            # No header yet, or truncated or replaced: start again
+            self.offset = 0
+        rows = []
+        with _open_binary(path) as handle:
+            _skip(handle, self.offset)
+            pending = b""
+            while limit is None or len(rows) < limit:
+                data = handle.read(READ_SIZE)
+                if not data:
+                    break
+                pending += data
+                records, used = complete_records(pending)
+                pending = pending[used:]
+                if self.offset == 0 and records:
+                    # The header, only once it is complete
+                    self.header = next(csv.reader([records[0].decode("utf-8-sig")]))
+                    self.offset += len(records[0])
+                    records = records[1:]
+                full = False
+                if not skip and limit is not None and len(records) >= limit - len(rows):
+                    # Stop right after the last record returned
+                    records = records[:limit - len(rows)]
+                    full = True
+                self.offset += sum(len(record) for record in records)
+                if skip:
+                    continue
+                text = b"".join(records).decode("utf-8")
+                for row in csv.reader(io.StringIO(text, newline="")):
+                    if row:
+                        rows.append(dict(zip(self.header, row)))
+                if full:
+                    break
+        return rows
+
+    def _room(self, rows):
+        # How many more rows this poll may return
+        return None if self.maxRows is None else self.maxRows - len(rows)
+
+    def poll(self):
+        """
+        Returns:
+            list: The rows written since the last poll, as dictionaries.
+        """
+        rows = []
+        moved = False
+        while True:
+            files = self._files()
+            if self.current is None and self._skipWritten and files:
+                # No checkpoint: only what is written from now on
+                self.current, self.offset, self.header = files[-1], 0, None
+                self._read_new(skip=True)
+                moved = True
+            self._skipWritten = False
+            if self.current is None or (self.current not in files and not os.path.exists(
+                    os.path.join(self.directory, self.current))):
+                following = self._next_file(files)
+                if following is None:
+                    break
+                self.current, self.offset, self.header = following, 0, None
+                moved = True
+            offset = self.offset
+            rows.extend(self._read_new(self._room(rows)))
+            full = self.maxRows is not None and len(rows) >= self.maxRows
+            following = None if full else self._next_file(files)
+            if following is not None:
+                # Rotated: the current file was closed before the next one was
+                # opened, so one more read gets everything that is left.
+                rows.extend(self._read_new(self._room(rows)))
+                if self.maxRows is not None and len(rows) >= self.maxRows:
+                    # The rest of it is for the next poll
+                    moved = True
+                    break
+                self.current, self.offset, self.header = following, 0, None
+                moved = True
+                continue
+            moved = moved or self.offset != offset
+            break
+        if moved:
+            self.save()
+        return rows
+
+    def follow(self, interval=1.0, stop=None):
+        """
+        Yield the new rows as they are written, polling every interval
+        seconds, until stop (a threading.Event) is set.
+        """
+        while stop is None or not stop.is_set():
+            for row in self.poll():
+                yield row
+            if stop is not None:
+                stop.wait(interval)
+            else:
+                time.sleep(interval)
@@ -0,0 +1,186 @@
+"""
+Time range queries over the rotated result logs.
+
+The date in a rotated log's name (see rotating_csv.parse_filename) is the
+period it covers, so a query only opens the files whose period overlaps the
+range asked for, and streams the matching rows as a generator.
+
+The files are listed in a manifest (manifest.json in the data directory),
+which is only refreshed when the directory's mtime changes, ie. when a file
+has been created, rotated, compressed or removed, rather than listing the
+directory for every query.
+
+.. code-block:
+
+    python log_query.py ping --target 8.8.8.8 --start "2021-07-23" --end "2021-07-24 12:00"
+
+    from log_query import query
+    for row in query("ping", target="8.8.8.8",
+                     start=datetime(2021, 7, 23), end=datetime(2021, 7, 24)):
+        print(row["Date"], row["Avg"])
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+
+from csv_common import BaseCsvFile
+from rotating_csv import parse_filename
+
+# stream -> default log suffix, the logfilename of its settings.ini section
+STREAMS = {"ping": "pingresults", "speed": "speedresults", "traceroute": "traceresults"}
+MANIFEST_FILE = "manifest.json"
+
+
+class Manifest():
+    """
+    The rotated logs in a directory, by suffix and period.
+    """
+    def __init__(self, directory="data"):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_FILE)
+        self.mtime = None
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as handle:
+                    saved = json.load(handle)
+                self.mtime = saved["mtime"]
+                self.entries = saved["entries"]
+            except (ValueError, KeyError):
+                self.mtime = None
+
+    def refresh(self):
+        """
+        Re-list the directory if it has changed since the last time.
+
+        Returns:
+            boolean: True if it was re-listed.
+        """
+        with self._lock:
+            # The manifest is rewritten in place, which does not change the
+            # directory's mtime, only creating it does.
+            if not os.path.exists(self.path):
+                open(self.path, "w").close()
+            mtime = os.stat(self.directory).st_mtime_ns
+            if mtime == self.mtime:
+                return False
+            entries = {}
+            for entry in os.scandir(self.directory):
+                info = parse_filename(entry.name)
+                if info is None or not entry.is_file():
+                    continue
+                entries[entry.name] = {"suffix": info["suffix"],
+                                       "start": info["start"].isoformat(),
+                                       "end": info["end"].isoformat(),
+                                       "part": info["part"],
+                                       "compressed": info["compressed"]}
+            self.entries = entries
+            self.mtime = mtime
+            with open(self.path, "w") as handle:
+                json.dump({"mtime": mtime, "entries": entries}, handle)
+            return True
+
+    def files(self, suffix, start=None, end=None):
+        """
+        The logs with suffix whose period overlaps [start, end), oldest first.
+        If a log exists both plain and compressed (while it is being
+        compressed) only the plain file is returned.
+
+        Returns:
+            list: The paths.
+        """
+        self.refresh()
+        start = start.isoformat() if start is not None else None
+        end = end.isoformat() if end is not None else None
+        chosen = {}
+        for name, entry in self.entries.items():
+            if entry["suffix"] != suffix:
+                continue
+            if start is not None and entry["end"] <= start:
+                continue
+            if end is not None and entry["start"] >= end:
+                continue
+            key = (entry["start"], entry["part"])
+            if key not in chosen or not entry["compressed"]:
+                chosen[key] = name
+        return [os.path.join(self.directory, chosen[key]) for key in sorted(chosen)]
+
+
+_manifests = {}
+
+
+def get_manifest(directory="data"):
+    """
+    The shared Manifest of a directory.
+    """
+    if directory not in _manifests:
+        _manifests[directory] = Manifest(directory)
+    return _manifests[directory]
+
+
+def query(stream, target=None, start=None, end=None, directory="data", suffix=None):
+    """
+    Stream the rows of a log in a time range.
+
+    Args:
+        stream (string): "ping", "speed" or "traceroute", or any log suffix.
+        target (string): Only rows for this target, every target if None.
+        start, end (datetime): start inclusive, end exclusive, either may be
+            None.
+        directory (string): Where the logs are.
+        suffix (string): The log suffix, if not the stream's default.
+
+    Yields:
+        dictionary: The matching rows, in time order.
+    """
+    suffix = suffix or STREAMS.get(stream, stream)
+    for path in get_manifest(directory).files(suffix, start, end):
+        source = BaseCsvFile(path)
+        try:
+            source.setup_read()
+        except RuntimeError:
+            # Removed (eg. compressed or pruned) since the manifest was read
+            continue
+        try:
+            for row in source.readrow():
+                if start is not None or end is not None:
+                    try:
+                        when = datetime.fromisoformat(row.get("Date") or "")
+                    except ValueError:
+                        continue
+                    if start is not None and when < start:
+                        continue
+                    if end is not None and when >= end:
+                        # The rows of a log are in time order
+                        break
+                if target is not None and row.get("target") != target:
+                    continue
+                yield row
+        finally:
+            source.close()
+
+
+def _datetime(text):
+    return datetime.fromisoformat(text) if text else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the logged results in a time range as csv.")
+    parser.add_argument("stream", help="ping, speed, traceroute, or a log suffix")
+    parser.add_argument("--target", default=None)
+    parser.add_argument("--start", type=_datetime, default=None, help="eg. 2021-07-23 or 2021-07-23 09:00")
+    parser.add_argument("--end", type=_datetime, default=None)
+    parser.add_argument("--directory", default="data")
+    parser.add_argument("--suffix", default=None)
+    args = parser.parse_args()
+    writer = None
+    for row in query(args.stream, args.target, args.start, args.end, args.directory, args.suffix):
+        if writer is None:
+            writer = csv.DictWriter(sys.stdout, fieldnames=list(row.keys()), lineterminator="\n")
+            writer.writeheader()
+        writer.writerow(row)
@@ -0,0 +1,210 @@
+"""
+Load the ping and speedtest logs straight into typed NumPy arrays.
+
+Rather than one dictionary of strings per row (BaseCsvFile.readrow()), the
+logs are read in chunks of rows with csv.reader, and each column of a chunk
+is converted in one go:
+
+    time        int64, epoch microseconds (-2**63 if missing)
+    float       float64 (NaN if missing)
+    int         int64 (-1 if missing)
+    category    int32 codes into a Categories, shared by every chunk
+
+so aggregations over a year of results are array operations:
+
+.. code-block:
+
+    from numpy_loader import load, PING_LAYOUT
+    columns, targets = load(["data/2021-07-23-pingresults.csv", ...], PING_LAYOUT)
+    google = columns["target"] == targets.code("8.8.8.8")
+    print(columns["Avg"][google].mean())
+
+    python numpy_loader.py [rows]       # benchmark against BaseCsvFile
+
+Plain and compressed (.gz / .zst) logs are read.  Requires numpy.
+"""
+import csv
+import itertools
+import sys
+import time
+from datetime import datetime, timedelta
+
+from csv_common import BaseCsvFile, open_text, resolve_compressed
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MISSING_TIME = -2 ** 63
+NAN = float("nan")
+
+# column -> kind, for csv_ping_headers / csv_speed_headers
+PING_LAYOUT = {"Date": "time", "target": "category", "Success": "int", "Sent": "int",
+               "Received": "int", "Packet Loss #": "int", "Min": "float", "Avg": "float",
+               "Max": "float"}
+SPEED_LAYOUT = {"Date": "time", "target": "category", "Location": "category",
+                "Upload Speed": "float", "Download Speed": "float", "Ping": "float",
+                "Latency": "float"}
+
+
+class Categories():
+    """
+    The values of the category columns, and their int32 codes.
+    """
+    def __init__(self):
+        self.codes = {}
+        self.names = []
+
+    def code(self, name):
+        """
+        The code of name, -1 if it has not been seen.
+        """
+        return self.codes.get(name, -1)
+
+    def encode(self, values):
+        codes = numpy.empty(len(values), dtype=numpy.int32)
+        for index, value in enumerate(values):
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.names)
+                self.names.append(value)
+            codes[index] = code
+        return codes
+
+
+def _local_offsets(naive):
+    # naive: local times as int64 microseconds since 1970-01-01 (no zone).
+    # Work out the UTC offset once per distinct hour rather than per row.
+    hours, inverse = numpy.unique(naive // 3600000000, return_inverse=True)
+    offsets = numpy.empty(len(hours), dtype=numpy.int64)
+    for index, hour in enumerate(hours):
+        local = datetime(1970, 1, 1) + timedelta(hours=int(hour))
+        offsets[index] = int(round(local.timestamp() - int(hour) * 3600)) * 1000000
+    return offsets[inverse]
+
+
+def convert(values, kind, categories):
+    """
+    Convert one column of a chunk, a sequence of strings.
+    """
+    if kind == "category":
+        return categories.encode(values)
+    # Python's float() / int() parse faster than numpy's string conversion
+    if kind == "float":
+        return numpy.fromiter((float(value) if value else NAN for value in values),
+                              numpy.float64, len(values))
+    if kind == "int":
+        return numpy.fromiter((int(value) if value else -1 for value in values),
+                              numpy.int64, len(values))
+    if kind == "time":
+        strings = numpy.array(values, dtype=str)
+        missing = strings == ""
+        naive = numpy.where(missing, "NaT", strings).astype("datetime64[us]").astype(numpy.int64)
+        present = ~missing
+        if present.any():
+            naive[present] += _local_offsets(naive[present])
+        return naive
+    raise ValueError("Unknown column kind: %s" % kind)
+
+
+def iter_chunks(path, layout=PING_LAYOUT, chunkRows=65536, categories=None):
+    """
+    Read a log in chunks.
+
+    Args:
+        path (string): The log, plain or compressed.
+        layout (dictionary): column -> kind, columns not in the file are
+            left out.
+        chunkRows (integer): Rows per chunk.
+        categories (Categories): Shared by the category columns, a new one
+            if None.
+
+    Yields:
+        dictionary: column -> numpy array, one chunk at a time.
+
+    Raises:
+        RuntimeError: If numpy is not installed.
+    """
+    if numpy is None:
+        raise RuntimeError("numpy_loader requires numpy.")
+    categories = categories if categories is not None else Categories()
+    with open_text(resolve_compressed(path), encoding="utf-8-sig") as handle:
+        reader = csv.reader(handle)
+        header = next(reader, None)
+        if header is None:
+            return
+        positions = [(column, header.index(column), kind) for column, kind in layout.items()
+                     if column in header]
+        width = len(header)
+        while True:
+            rows = list(itertools.islice(reader, chunkRows))
+            if not rows:
+                return
+            if any(len(row) != width for row in rows):
+                # Blank or partly written lines
+                rows = [row for row in rows if len(row) == width]
+                if not rows:
+                    continue
+            columns = list(zip(*rows))
+            yield {column: convert(columns[position], kind, categories)
+                   for column, position, kind in positions}
+
+
+def load(paths, layout=PING_LAYOUT, chunkRows=65536):
+    """
+    Load logs into one array per column.
+
+    Returns:
+        tuple: (column -> numpy array, Categories)
+    """
+    categories = Categories()
+    chunks = {column: [] for column in layout}
+    if isinstance(paths, str):
+        paths = [paths]
+    for path in paths:
+        for chunk in iter_chunks(path, layout, chunkRows, categories):
+            for column, values in chunk.items():
+                chunks[column].append(values)
+    return {column: numpy.concatenate(values) for column, values in chunks.items() if values}, \
+        categories
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "2021-07-23-pingresults.csv")
+        with open(path, "w", newline="") as handle:
+            writer = csv.writer(handle, quoting=csv.QUOTE_ALL, lineterminator="\n")
+            writer.writerow(list(PING_LAYOUT))
+            for count in range(rows):
+                writer.writerow([datetime(2021, 7, 23, count // 3600 % 24, count // 60 % 60,
+                                          count % 60, 123456),
+                                 "8.8.8.8" if count % 2 else "1.1.1.1", 5, 5, 5, 0,
+                                 10.0, 11.5 + count % 7, 30.0])
+
+        # Typed values per row, then the mean RTT of each target
+        start = time.perf_counter()
+        source = BaseCsvFile(path)
+        source.setup_read()
+        sums = {}
+        for row in source.readrow():
+            typed = {"Date": datetime.fromisoformat(row["Date"]).timestamp(),
+                     "target": row["target"],
+                     "Sent": int(row["Sent"]), "Received": int(row["Received"]),
+                     "Min": float(row["Min"]), "Avg": float(row["Avg"]), "Max": float(row["Max"])}
+            total, count = sums.get(typed["target"], (0.0, 0))
+            sums[typed["target"]] = (total + typed["Avg"], count + 1)
+        source.close()
+        before = time.perf_counter() - start
+
+        start = time.perf_counter()
+        columns, targets = load(path)
+        means = {name: columns["Avg"][columns["target"] == code].mean()
+                 for code, name in enumerate(targets.names)}
+        after = time.perf_counter() - start
+    print("readrow:       %d rows/second" % (rows / before))
+    print("numpy_loader:  %d rows/second" % (rows / after))
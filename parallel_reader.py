@@ -0,0 +1,222 @@
+"""
+Scan many rotated logs in parallel.
+
+Each file is read with BaseCsvFile in a worker process, and reduced there by
+a per file reducer: a picklable callable that takes the file's rows (an
+iterator of dictionaries) and returns a partial result.  Only the partial
+results come back to the parent, where they are merged, in file order, with
+merge() (or a merge function of your own).
+
+merge() adds numbers, merges dictionaries key by key and adds lists (eg.
+histogram bins) element by element, which covers the counts, sums and
+histograms below.
+
+.. code-block:
+
+    from parallel_reader import scan_logs, CountBy, SumBy, Histogram
+    counts = scan_logs("ping", CountBy("target"))
+    # {'8.8.8.8': 86400, '1.1.1.1': 86400}
+    loss = scan_logs("ping", SumBy("target", ["Sent", "Packet Loss #"]),
+                     start=datetime(2021, 1, 1), end=datetime(2022, 1, 1))
+    rtts = scan_logs("ping", Histogram("Avg", [0, 10, 20, 50, 100, 1000]))
+
+    python parallel_reader.py [files] [rows per file]   # benchmark
+"""
+import bisect
+import concurrent.futures
+import os
+import sys
+import time
+import traceback
+from datetime import datetime
+
+from csv_common import BaseCsvFile
+from log_query import STREAMS, get_manifest
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class CountBy():
+    """
+    Rows per value of a column.
+    """
+    def __init__(self, field):
+        self.field = field
+
+    def __call__(self, rows):
+        counts = {}
+        for row in rows:
+            value = row.get(self.field)
+            counts[value] = counts.get(value, 0) + 1
+        return counts
+
+
+class SumBy():
+    """
+    The sums of numeric columns, per value of a key column.
+    """
+    def __init__(self, field, columns):
+        self.field = field
+        self.columns = list(columns)
+
+    def __call__(self, rows):
+        sums = {}
+        for row in rows:
+            totals = sums.setdefault(row.get(self.field), dict.fromkeys(self.columns, 0.0))
+            for column in self.columns:
+                value = _float(row.get(column))
+                if value is not None:
+                    totals[column] += value
+        return sums
+
+
+class Histogram():
+    """
+    Counts of a numeric column in the bins [edges[0], edges[1]), ...,
+    [edges[-2], edges[-1]), values outside the edges are not counted.
+    """
+    def __init__(self, field, edges):
+        self.field = field
+        self.edges = sorted(edges)
+
+    def __call__(self, rows):
+        bins = [0] * (len(self.edges) - 1)
+        for row in rows:
+            value = _float(row.get(self.field))
+            if value is None:
+                continue
+            index = bisect.bisect_right(self.edges, value) - 1
+            if 0 <= index < len(bins):
+                bins[index] += 1
+        return bins
+
+
+def merge(total, partial):
+    """
+    Merge two partial results.
+
+    >>> merge({"a": 1, "b": [1, 2]}, {"a": 2, "b": [0, 1], "c": 5})
+    {'a': 3, 'b': [1, 3], 'c': 5}
+    """
+    if total is None:
+        return partial
+    if partial is None:
+        return total
+    if isinstance(total, dict):
+        merged = dict(total)
+        for key, value in partial.items():
+            merged[key] = merge(merged.get(key), value)
+        return merged
+    if isinstance(total, list):
+        return [merge(left, right) for left, right in zip(total, partial)]
+    return total + partial
+
+
+def _rows_in_range(rows, start, end):
+    for row in rows:
+        try:
+            when = datetime.fromisoformat(row.get("Date") or "")
+        except ValueError:
+            continue
+        if start is not None and when < start:
+            continue
+        if end is not None and when >= end:
+            continue
+        yield row
+
+
+def reduce_file(path, reducer, start=None, end=None):
+    """
+    Run reducer over the rows of one file (in the worker process).
+    """
+    source = BaseCsvFile(path)
+    source.setup_read()
+    try:
+        rows = source.readrow()
+        if start is not None or end is not None:
+            rows = _rows_in_range(rows, start, end)
+        return reducer(rows)
+    finally:
+        source.close()
+
+
+def scan(paths, reducer, mergeFunc=merge, workers=None, start=None, end=None):
+    """
+    Reduce every file in a pool of worker processes, and merge the results.
+
+    Args:
+        paths (list): The files.
+        reducer (callable): Picklable (eg. a module level function, or an
+            instance of a module level class), rows -> partial result.
+        mergeFunc (function): (total, partial) -> total, total is None for
+            the first partial result.
+        workers (integer): Number of processes, os.cpu_count() if None.
+        start, end (datetime): If set, only the rows in [start, end) are
+            given to the reducer.
+
+    Returns:
+        The merged result, None if there were no files.
+    """
+    paths = [str(path) for path in paths]
+    total = None
+    if not paths:
+        return total
+    workers = max(1, min(workers or os.cpu_count() or 1, len(paths)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(reduce_file, path, reducer, start, end) for path in paths]
+        for path, future in zip(paths, futures):
+            try:
+                total = mergeFunc(total, future.result())
+            except Exception as e:
+                print("Error reading %s: %s" % (path, e))
+                traceback.print_exc()
+    return total
+
+
+def scan_logs(stream, reducer, start=None, end=None, directory="data", suffix=None, **kwargs):
+    """
+    scan() the logs of a stream ("ping", "speed", "traceroute" or a suffix)
+    that overlap [start, end), as listed by the log_query manifest.
+    """
+    suffix = suffix or STREAMS.get(stream, stream)
+    paths = get_manifest(directory).files(suffix, start, end)
+    return scan(paths, reducer, start=start, end=end, **kwargs)
+
+
+if __name__ == "__main__":
+    import csv
+    import tempfile
+
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 48
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for number in range(files):
+            path = os.path.join(directory, "2021-07-%02d %02d-pingresults.csv" % (
+                1 + number // 24, number % 24))
+            with open(path, "w", newline="") as handle:
+                writer = csv.writer(handle, quoting=csv.QUOTE_ALL, lineterminator="\n")
+                writer.writerow(["Date", "target", "Avg"])
+                for count in range(rows):
+                    writer.writerow(["2021-07-01 00:00:00", "target%d" % (count % 4),
+                                     count % 97])
+            paths.append(path)
+        reducer = Histogram("Avg", range(0, 101, 10))
+
+        start = time.perf_counter()
+        serial = None
+        for path in paths:
+            serial = merge(serial, reduce_file(path, reducer))
+        before = time.perf_counter() - start
+
+        start = time.perf_counter()
+        parallel = scan(paths, reducer)
+        after = time.perf_counter() - start
+        assert serial == parallel
+    print("serial:    %.2f seconds" % before)
+    print("parallel:  %.2f seconds (%d processes)" % (after, min(os.cpu_count() or 1, files)))
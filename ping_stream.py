@@ -0,0 +1,382 @@
+"""
+Continuous streaming ping.
+
+Instead of a burst of numPings packets every runEvery seconds, one long lived
+ping process is started per target and its reply lines are streamed through a
+generator pipeline that aggregates them into fixed windows, producing one
+csv_ping_headers row per target per window.  An outage between bursts can no
+longer go unnoticed, and a process is spawned once per target instead of once
+per target per interval.  A ping process that exits (unreachable host, DNS
+failure, ...) is restarted, with a backoff, and the window in progress when
+the streamer is stopped is still reported.
+
+The pipeline, all run on one thread however many targets there are:
+
+    merged_lines()      (target, timestamp, line) from every ping process,
+                        plus (None, now, None) ticks while they are silent
+    parse_events()      (target, timestamp, icmp_seq, rtt_ms or None)
+    window_summaries()  one result dictionary per target per window
+
+.. code-block:
+
+    from ping_stream import StreamingPinger
+    streamer = StreamingPinger(["8.8.8.8", "1.1.1.1"], window=60,
+                               onResult=pingtest.logPingResults)
+    streamer.start()
+    ...
+    streamer.stop()
+"""
+import math
+import os
+import re
+import selectors
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+from icmp_ping import summarise
+import pingparser
+
+# iputils: -D prefixes replies with a timestamp, -O reports unanswered requests
+DEFAULT_COMMAND = ["ping", "-n", "-D", "-O"]
+
+_no_answer = re.compile(r"no answer yet for icmp_seq=(\d+)")
+
+
+def merged_lines(processes, tick=1.0, stopEvent=None, spawn=None, maxBackoff=60.0):
+    """
+    Multiplex the stdout of several ping processes.
+
+    Args:
+        processes (dictionary): target -> subprocess.Popen, updated as
+            processes are restarted.
+        tick (float): Yield a (None, now, None) tick after this many seconds
+            without output, so windows still close during a total outage.
+        stopEvent (threading.Event): Stop when set.
+        spawn (function): target -> a new subprocess.Popen.  If given, a
+            process that exits (unreachable host, DNS failure, ...) is
+            restarted after a backoff that doubles, up to maxBackoff
+            seconds, while it keeps exiting sooner than that.  If None, it
+            is not restarted.
+        maxBackoff (float): The longest wait before a restart.
+
+    Yields:
+        tuple: (target, time.time(), line), line is None when the target's
+            process has just been restarted.
+    """
+    selector = selectors.DefaultSelector()
+    partial = {}
+    started = {}
+    backoff = {}
+    restarts = {}
+
+    def watch(target, process):
+        selector.register(process.stdout.fileno(), selectors.EVENT_READ, target)
+        partial[target] = b""
+        started[target] = time.monotonic()
+
+    for target, process in processes.items():
+        watch(target, process)
+    try:
+        while (selector.get_map() or restarts) and not (stopEvent and stopEvent.is_set()):
+            timeout = tick
+            if restarts:
+                timeout = max(0, min(tick, min(restarts.values()) - time.monotonic()))
+            if selector.get_map():
+                ready = selector.select(timeout=timeout)
+            else:
+                ready = []
+                if stopEvent is not None:
+                    stopEvent.wait(timeout)
+                else:
+                    time.sleep(timeout)
+            now = time.time()
+            for target, due in list(restarts.items()):
+                if due > time.monotonic() or (stopEvent and stopEvent.is_set()):
+                    continue
+                del restarts[target]
+                try:
+                    processes[target] = spawn(target)
+                except OSError as e:
+                    print("Error restarting ping for %s: %s" % (target, e))
+                    restarts[target] = time.monotonic() + backoff[target]
+                    backoff[target] = min(backoff[target] * 2, maxBackoff)
+                    continue
+                watch(target, processes[target])
+                yield (target, now, None)
+            if not ready:
+                yield (None, now, None)
+                continue
+            for key, _ in ready:
+                target = key.data
+                # os.read, not readline, so no lines are left hidden in a
+                # buffer that select() knows nothing about.
+                data = os.read(key.fd, 65536)
+                if data == b"":
+                    # the ping process exited
+                    selector.unregister(key.fd)
+                    if partial[target]:
+                        yield (target, now, partial[target].decode("utf-8", "replace"))
+                    processes[target].stdout.close()
+                    processes[target].wait()
+                    if spawn is not None:
+                        if time.monotonic() - started[target] >= maxBackoff:
+                            backoff[target] = 1.0
+                        delay = backoff.get(target, 1.0)
+                        backoff[target] = min(delay * 2, maxBackoff)
+                        restarts[target] = time.monotonic() + delay
+                        print("Ping for %s exited, restarting in %g seconds" % (target, delay))
+                    continue
+                lines = (partial[target] + data).split(b"\n")
+                partial[target] = lines.pop()
+                for line in lines:
+                    yield (target, now, line.decode("utf-8", "replace"))
+    finally:
+        selector.close()
+
+
+def parse_events(lines):
+    """
+    Turn ping output lines into reply / loss events.
+
+    Yields:
+        tuple: (target, timestamp, icmp_seq, rtt_ms) for a reply,
+               (target, timestamp, icmp_seq, None) for an unanswered request,
+               (target, timestamp, None, None) when the process restarted,
+               (None, timestamp, None, None) for a tick.
+    """
+    for target, now, line in lines:
+        if target is None or line is None:
+            yield (target, now, None, None)
+            continue
+        reply = pingparser.parse_reply_line(line)
+        if reply is not None:
+            seq, rtt, stamp = reply
+            yield (target, stamp or now, seq, rtt)
+            continue
+        lost = _no_answer.search(line)
+        if lost is not None:
+            yield (target, now, int(lost.group(1)), None)
+
+
+class _Window():
+    __slots__ = ("start", "rtts", "seqs", "lastSeq", "samples", "sentBefore", "replied", "lost")
+
+    def __init__(self, start, lastSeq):
+        self.start = start
+        self.rtts = []
+        self.seqs = set()
+        self.lastSeq = lastSeq
+        self.samples = []
+        self.replied = set()
+        # seq -> index in samples, of the requests -O reported unanswered
+        self.lost = {}
+        # requests sent by processes that have since been restarted
+        self.sentBefore = 0
+
+
+def _ahead(seq, lastSeq):
+    """
+    How far seq is past lastSeq, allowing for icmp_seq wrapping at 65536, 0
+    if it is not past it (a late reply to an earlier request).
+
+    >>> _ahead(12, 10), _ahead(8, 10), _ahead(10, 10), _ahead(3, 65530)
+    (2, 0, 0, 9)
+    """
+    distance = (seq - lastSeq) % 65536
+    return distance if distance < 32768 else 0
+
+
+def _window_sent(window, interval, length):
+    """
+    Number of requests sent during the window.  Taken from the sequence
+    numbers seen where possible (so gaps count as loss even without -O),
+    estimated from the send interval if no new request was seen.
+    """
+    if not window.seqs:
+        return window.sentBefore or int(length / interval)
+    if window.lastSeq is None:
+        return window.sentBefore + max(max(window.seqs) - min(window.seqs) + 1,
+                                       len(window.seqs))
+    ahead = [_ahead(seq, window.lastSeq) for seq in window.seqs]
+    ahead = [distance for distance in ahead if distance]
+    if not ahead:
+        # only late replies to the previous window's requests
+        return window.sentBefore or int(length / interval)
+    return window.sentBefore + max(max(ahead), len(ahead))
+
+
+def _window_last_seq(window):
+    """
+    The newest sequence number seen by the end of the window.
+    """
+    if window.lastSeq is None:
+        return max(window.seqs) if window.seqs else None
+    ahead = max([_ahead(seq, window.lastSeq) for seq in window.seqs] or [0])
+    return (window.lastSeq + ahead) % 65536
+
+
+def window_summaries(events, targets, window=60, interval=1.0):
+    """
+    Aggregate events into fixed, wall clock aligned windows.
+
+    Args:
+        events (generator): From parse_events().
+        targets (list): All of the streamed targets, so that a target with
+            no output at all is still reported (with 100% loss).
+        window (integer): Window length in seconds.
+        interval (float): Seconds between the requests ping sends.
+
+    Yields:
+        dictionary: csv_ping_headers style result for one target and window.
+    """
+    current = None
+    windows = {}
+    now = None
+    for target, now, seq, rtt in events:
+        start = math.floor(now / window) * window
+        if current is None:
+            current = start
+            windows = {name: _Window(start, None) for name in targets}
+        if start > current:
+            for name in targets:
+                state = windows[name]
+                result = summarise(name, _window_sent(state, interval, window), state.rtts,
+                                   state.samples)
+                result["Date"] = datetime.fromtimestamp(current + window)
+                yield result
+                windows[name] = _Window(start, _window_last_seq(state))
+            current = start
+        if target is None or target not in windows:
+            continue
+        state = windows[target]
+        if seq is None:
+            # a new process, its sequence numbers start again
+            if state.seqs:
+                state.sentBefore = _window_sent(state, interval, 0)
+            state.seqs = set()
+            state.replied = set()
+            state.lost = {}
+            state.lastSeq = None
+            continue
+        if state.lastSeq is not None and not _ahead(seq, state.lastSeq):
+            # a late reply to a request of an earlier window, which has
+            # already been counted (as lost) there
+            continue
+        # the send time is only known relative to when the line was read
+        received_ns = time.monotonic_ns()
+        if rtt is not None:
+            if seq in state.replied:
+                # a duplicate
+                continue
+            state.replied.add(seq)
+            state.rtts.append(rtt)
+            sample = (received_ns - int(rtt * 1e6), rtt)
+            if seq in state.lost:
+                # answered after -O reported it, in the same window
+                state.samples[state.lost.pop(seq)] = sample
+            else:
+                state.samples.append(sample)
+        elif seq not in state.replied and seq not in state.lost:
+            state.lost[seq] = len(state.samples)
+            state.samples.append((received_ns, None))
+        state.seqs.add(seq)
+    if current is None or not any(windows[name].seqs or windows[name].sentBefore
+                                  for name in targets):
+        return
+    # stopped part way through a window, report what there is of it
+    length = max(now - current, interval)
+    for name in targets:
+        state = windows[name]
+        result = summarise(name, _window_sent(state, interval, length), state.rtts,
+                           state.samples)
+        result["Date"] = datetime.fromtimestamp(now)
+        yield result
+
+
+class StreamingPinger():
+    """
+    Runs one long lived ping process per target and reports a summary of each
+    window through onResult.
+    """
+    def __init__(self, targets, window=60, interval=1.0, command=None, onResult=print):
+        """
+        Args:
+            targets (list): Hosts to ping.
+            window (integer): Seconds per summary row.
+            interval (float): Seconds between requests (ping -i).
+            command (list): The ping command line, without -i and target.
+                Defaults to DEFAULT_COMMAND, whose -D and -O are iputils
+                only.
+            onResult (function): Called with each window's result dictionary.
+        """
+        self.targets = list(targets)
+        self.window = window
+        self.interval = interval
+        self.command = list(command) if command else list(DEFAULT_COMMAND)
+        self.onResult = onResult
+        self.processes = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _spawn(self, target):
+        return subprocess.Popen(self.command + ["-i", str(self.interval), target],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def start(self, startupCheck=1.0):
+        """
+        Start a ping process per target, and the thread that reads them.
+
+        Args:
+            startupCheck (float): Seconds to watch the new processes for.
+
+        Raises:
+            RuntimeError: If a ping process fails straight away (a non-zero
+                exit), eg. the command or its options are not supported by
+                this ping.
+        """
+        for target in self.targets:
+            self.processes[target] = self._spawn(target)
+        deadline = time.monotonic() + startupCheck
+        for target, process in self.processes.items():
+            try:
+                code = process.wait(timeout=max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                continue
+            if code == 0:
+                continue
+            for other in self.processes.values():
+                if other.poll() is None:
+                    other.kill()
+                    other.wait()
+            raise RuntimeError("%s failed at once with status %s, check streamCommand" % (
+                " ".join(self.command + ["-i", str(self.interval), target]), code))
+        self._thread = threading.Thread(target=self._run, name="ping-stream", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        events = parse_events(merged_lines(self.processes, stopEvent=self._stop,
+                                           spawn=self._spawn))
+        for result in window_summaries(events, self.targets, self.window, self.interval):
+            try:
+                self.onResult(result)
+            except Exception as e:
+                print("Error logging streamed ping for %s: %s" % (result["target"], e))
+
+    def stop(self):
+        """
+        Stop the ping processes, reporting the window in progress.
+        """
+        self._stop.set()
+        # The stream thread stops within a tick, then reports the partial
+        # window before the processes go.
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
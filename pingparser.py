@@ -0,0 +1,163 @@
+"""
+Fast parser for the output of the system ping command.
+
+Derived from old/pingparser.py, but with the patterns compiled once at import
+and extended to return the RTT of every reply as well as the summary.
+Understands the Linux iputils, busybox and BSD / macOS output formats,
+including iputils' ``-D`` timestamp prefix.
+
+parse() returns the same keys as ``pingparsing.PingParsing().parse().as_dict()``
+(so it can be used in its place by PingTest.doPingTest), plus ``replies``: a
+list of (icmp_seq, rtt_ms, timestamp) tuples, timestamp is None unless ping was
+run with -D, and ``first_seq``: the icmp_seq of the first request, 1 for iputils
+and 0 for busybox and BSD / macOS, told apart by their summary line.
+
+The recorded outputs in ping_samples/ are used as the corpus for the
+benchmark against pingparsing:
+
+    python pingparser.py [iterations]
+
+>>> result = parse(open("ping_samples/busybox_loss.txt").read())
+>>> result["packet_transmit"], result["packet_receive"], result["packet_loss_count"]
+(4, 2, 2)
+>>> result["rtt_avg"], [rtt for seq, rtt, stamp in result["replies"]]
+(12.709, [12.401, 13.018])
+>>> result["first_seq"], parse(open("ping_samples/iputils_all_lost.txt").read())["first_seq"]
+(0, 1)
+"""
+import glob
+import math
+import os
+import re
+import sys
+import time
+
+_header = re.compile(r"^PING (\S+)", re.MULTILINE)
+_reply = re.compile(r"^(?:\[(\d+\.\d+)\] )?\d+ bytes from [^:]+: "
+                    r"(?:icmp_)?seq=(\d+) .*?time[=<]([\d.]+) ?ms", re.MULTILINE)
+_counts = re.compile(r"^(\d+) packets transmitted, (\d+) (packets )?received"
+                     r"(?:, \+(\d+) errors)?(?:, \+\d+ duplicates)?", re.MULTILINE)
+_rtt = re.compile(r"^(?:rtt|round-trip) min/avg/max(?:/(?:mdev|stddev))? = "
+                  r"([\d.]+)/([\d.]+)/([\d.]+)(?:/([\d.]+))?", re.MULTILINE)
+
+
+def parse_reply_line(line):
+    """
+    Parse a single reply line, for callers that stream ping's output.
+
+    Returns:
+        tuple: (icmp_seq, rtt_ms, timestamp) or None if the line is not an
+            echo reply.  timestamp is None unless ping was run with -D.
+
+    >>> parse_reply_line("64 bytes from 8.8.8.8: icmp_seq=3 ttl=117 time=21.0 ms")
+    (3, 21.0, None)
+    >>> parse_reply_line("From 10.0.0.5 icmp_seq=1 Destination Host Unreachable")
+    """
+    match = _reply.match(line)
+    if match is None:
+        return None
+    stamp, seq, rtt = match.groups()
+    return (int(seq), float(rtt), None if stamp is None else float(stamp))
+
+
+def parse(ping_output):
+    """
+    Parse the complete output of one ping run.
+
+    Args:
+        ping_output (string): The text written to stdout by ping.
+
+    Returns:
+        dictionary: pingparsing compatible statistics, plus "replies".
+
+    Raises:
+        ValueError: If the output does not contain a ping summary.
+    """
+    counts = _counts.search(ping_output)
+    if counts is None:
+        raise ValueError("Invalid PING output:\n" + ping_output)
+    transmit, receive, bsd, errors = counts.groups()
+    transmit = int(transmit)
+    receive = int(receive)
+
+    replies = [(int(seq), float(rtt), float(stamp) if stamp else None)
+               for stamp, seq, rtt in _reply.findall(ping_output)]
+
+    rtt = _rtt.search(ping_output)
+    if rtt is not None:
+        rtt_min, rtt_avg, rtt_max, rtt_mdev = [None if value is None else float(value)
+                                               for value in rtt.groups()]
+    else:
+        rtt_min = rtt_avg = rtt_max = rtt_mdev = None
+    if rtt_mdev is None and replies:
+        # busybox does not report the deviation, compute it like iputils does
+        values = [reply[1] for reply in replies]
+        mean = sum(values) / len(values)
+        rtt_mdev = round(math.sqrt(sum((value - mean) ** 2 for value in values) / len(values)), 3)
+
+    header = _header.search(ping_output)
+    return {"destination": header.group(1) if header else None,
+            "packet_transmit": transmit,
+            "packet_receive": receive,
+            "packet_loss_count": transmit - receive,
+            "packet_loss_rate": (100.0 * (transmit - receive) / transmit) if transmit else None,
+            "packet_errors": int(errors) if errors else 0,
+            "rtt_min": rtt_min,
+            "rtt_avg": rtt_avg,
+            "rtt_max": rtt_max,
+            "rtt_mdev": rtt_mdev,
+            "replies": replies,
+            "first_seq": 0 if bsd else 1}
+
+
+def load_corpus(directory=None):
+    """
+    Returns:
+        dictionary: sample filename -> recorded ping output.
+    """
+    if directory is None:
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ping_samples")
+    corpus = {}
+    for filename in sorted(glob.glob(os.path.join(directory, "*.txt"))):
+        with open(filename) as sample:
+            corpus[os.path.basename(filename)] = sample.read()
+    return corpus
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    corpus = load_corpus()
+    for name, text in corpus.items():
+        result = parse(text)
+        print("%-24s sent %s recv %s avg %s replies %s" % (name, result["packet_transmit"],
+              result["packet_receive"], result["rtt_avg"], len(result["replies"])))
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for text in corpus.values():
+            parse(text)
+    fast = time.perf_counter() - start
+    total = iterations * len(corpus)
+    print("pingparser:  %d parses in %.3fs (%.1f us/parse)" % (total, fast, fast / total * 1e6))
+
+    try:
+        import pingparsing
+    except ImportError:
+        print("pingparsing not installed, skipping the comparison")
+        sys.exit()
+    parser = pingparsing.PingParsing()
+    for name, text in corpus.items():
+        theirs = parser.parse(text).as_dict()
+        ours = parse(text)
+        for key in ("packet_transmit", "packet_receive", "packet_loss_count",
+                    "rtt_min", "rtt_avg", "rtt_max"):
+            if theirs[key] != ours[key]:
+                print("Mismatch %s %s: pingparsing %s, pingparser %s" % (name, key,
+                      theirs[key], ours[key]))
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for text in corpus.values():
+            parser.parse(text)
+    slow = time.perf_counter() - start
+    print("pingparsing: %d parses in %.3fs (%.1f us/parse), %.1fx slower" % (total, slow,
+          slow / total * 1e6, slow / fast))
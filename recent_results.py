@@ -0,0 +1,212 @@
+"""
+The most recent results of each target, held in memory.
+
+Questions like "what was the loss over the last hour" are answered from here
+rather than by re-reading the logs.  Each target gets a ResultRing: fixed
+size array.array('d') columns (one for the time, one per numeric field)
+written in a circle, so adding a result is O(1) and stores no per row
+objects.  Window statistics work on whole columns; with numpy installed the
+columns are viewed in place (numpy.frombuffer) rather than copied.
+
+Missing values are stored as NaN and left out of the statistics.
+
+.. code-block:
+
+    import recent_results
+    history = recent_results.get_history("ping", ["Sent", "Packet Loss #", "Avg"])
+    history.append(row)             # row["Date"] (datetime), row["target"]
+    history.stats("8.8.8.8", "Avg", seconds=3600)
+    # {'count': 60, 'min': 11.2, 'mean': 14.9, 'max': 48.1, 'sum': 894.0}
+    history.ratio(None, "Packet Loss #", "Sent", seconds=3600)    # all targets
+"""
+import array
+import bisect
+import math
+import threading
+import time
+from datetime import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NAN = float("nan")
+
+_histories = {}
+_histories_lock = threading.Lock()
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+def _epoch(value):
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if value is None:
+        return time.time()
+    return float(value)
+
+
+def column_stats(values):
+    """
+    Count, min, mean, max and sum of the non NaN values.
+
+    >>> column_stats(array.array("d", [1.0, float("nan"), 3.0]))
+    {'count': 2, 'min': 1.0, 'mean': 2.0, 'max': 3.0, 'sum': 4.0}
+    >>> column_stats(array.array("d"))["mean"] is None
+    True
+    """
+    if numpy is not None:
+        values = numpy.frombuffer(values, dtype=numpy.float64) if len(values) else numpy.empty(0)
+        values = values[~numpy.isnan(values)]
+        if not len(values):
+            return {"count": 0, "min": None, "mean": None, "max": None, "sum": 0.0}
+        total = float(values.sum())
+        return {"count": int(len(values)), "min": float(values.min()),
+                "mean": total / len(values), "max": float(values.max()), "sum": total}
+    values = [value for value in values if not math.isnan(value)]
+    if not values:
+        return {"count": 0, "min": None, "mean": None, "max": None, "sum": 0.0}
+    total = math.fsum(values)
+    return {"count": len(values), "min": min(values), "mean": total / len(values),
+            "max": max(values), "sum": total}
+
+
+class ResultRing():
+    """
+    The last capacity results of one target.
+    """
+    def __init__(self, fields, capacity=1024):
+        """
+        Args:
+            fields (list): The numeric fields kept.
+            capacity (integer): How many results are kept.
+        """
+        self.fields = list(fields)
+        self.capacity = max(1, capacity)
+        self.times = array.array("d", [NAN]) * self.capacity
+        self.columns = {field: array.array("d", [NAN]) * self.capacity for field in self.fields}
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, when, row):
+        """
+        Args:
+            when (float): Epoch seconds, not before the previous result.
+            row (dictionary): The result, keyed by field.
+        """
+        self.times[self.head] = when
+        for field in self.fields:
+            self.columns[field][self.head] = _number(row.get(field))
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def _ordered(self, column):
+        # Oldest first, as one array.
+        start = (self.head - self.count) % self.capacity
+        if start + self.count <= self.capacity:
+            return column[start:start + self.count]
+        return column[start:] + column[:self.head]
+
+    def window(self, field, seconds=None, last=None, now=None):
+        """
+        The values of field in the window, oldest first.
+
+        Args:
+            seconds (float): Only the results from the last this many seconds.
+            last (integer): Only the last this many results.
+            now (float): Epoch seconds, time.time() if None.
+
+        Returns:
+            array.array: The values.
+        """
+        values = self._ordered(self.columns[field])
+        if seconds is not None:
+            cutoff = (time.time() if now is None else now) - seconds
+            values = values[bisect.bisect_left(self._ordered(self.times), cutoff):]
+        if last is not None:
+            values = values[max(0, len(values) - last):]
+        return values
+
+
+class RecentResults():
+    """
+    A ResultRing per target, safe to share between threads.
+    """
+    def __init__(self, fields, capacity=1024):
+        self.fields = list(fields)
+        self.capacity = capacity
+        self.rings = {}
+        self._lock = threading.Lock()
+
+    def append(self, row):
+        """
+        Record a result, row["Date"] is its time and row["target"] its
+        target.
+        """
+        when = _epoch(row.get("Date"))
+        with self._lock:
+            ring = self.rings.get(row.get("target"))
+            if ring is None:
+                ring = self.rings[row.get("target")] = ResultRing(self.fields, self.capacity)
+            ring.append(when, row)
+
+    def targets(self):
+        with self._lock:
+            return list(self.rings)
+
+    def window(self, target, field, seconds=None, last=None, now=None):
+        """
+        The values of field for target (or every target if None) in the
+        window, see ResultRing.window().
+        """
+        with self._lock:
+            if target is not None:
+                ring = self.rings.get(target)
+                return ring.window(field, seconds, last, now) if ring else array.array("d")
+            values = array.array("d")
+            for ring in self.rings.values():
+                values.extend(ring.window(field, seconds, last, now))
+            return values
+
+    def stats(self, target, field, seconds=None, last=None, now=None):
+        """
+        Returns:
+            dictionary: count, min, mean, max and sum of field in the window.
+        """
+        return column_stats(self.window(target, field, seconds, last, now))
+
+    def summary(self, target, seconds=None, last=None, now=None):
+        """
+        Returns:
+            dictionary: The stats of every field, keyed by field.
+        """
+        return {field: self.stats(target, field, seconds, last, now) for field in self.fields}
+
+    def ratio(self, target, numerator, denominator, seconds=None, last=None, now=None):
+        """
+        sum(numerator) / sum(denominator) over the window, eg. the packet loss
+        ratio.  None if there is nothing in the window.
+        """
+        below = self.stats(target, denominator, seconds, last, now)["sum"]
+        if not below:
+            return None
+        return self.stats(target, numerator, seconds, last, now)["sum"] / below
+
+
+def get_history(name, fields, capacity=1024):
+    """
+    Return the shared history of a result stream, creating it on first use.
+    """
+    with _histories_lock:
+        if name not in _histories:
+            _histories[name] = RecentResults(fields, capacity)
+        return _histories[name]
@@ -0,0 +1,158 @@
+"""
+Shared, thread safe writer for the result logs.
+
+Each log stream (ping, speedtest, traceroute) gets a single ResultWriter that
+owns its RotatingCsvFile.  Probe threads only put rows on the writer's queue;
+the writer thread writes them and commits in groups, flushing every
+flushRows rows or flushMs milliseconds, whichever comes first.
+
+fsync policy:
+
+    never   - leave it to the OS.
+    commit  - fsync after every group commit.
+    close   - fsync once, when the writer is closed (the default).
+
+.. code-block:
+
+    import result_writer
+    writer = result_writer.get_writer("ping", lambda: RotatingCsvFile(...))
+    writer.write(row)
+    ...
+    result_writer.close_all()       # drains every queue, on shutdown
+"""
+import queue
+import threading
+import time
+import traceback
+
+FSYNC_POLICIES = ("never", "commit", "close")
+
+_STOP = object()
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+class ResultWriter():
+    """
+    A queue fed writer thread for one log stream.
+    """
+    def __init__(self, logger, flushRows=50, flushMs=1000, fsync="close", name="results"):
+        """
+        Args:
+            logger (BaseCsvFile): The file to write to, already set up for
+                writing or appending.  Only the writer thread touches it.
+            flushRows (integer): Commit after this many rows.
+            flushMs (integer): Commit rows that have waited this long.
+            fsync (string): One of FSYNC_POLICIES.
+            name (string): Used for the thread name.
+
+        Raises:
+            ValueError: On an unknown fsync policy.
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy: %s" % fsync)
+        self.logger = logger
+        self.flushRows = max(1, flushRows)
+        self.flushSeconds = flushMs / 1000.0
+        self.fsync = fsync
+        self.rowsWritten = 0
+        self.commits = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="%s-writer" % name,
+                                        daemon=True)
+        self._thread.start()
+
+    def write(self, row, after=None):
+        """
+        Queue a row.
+
+        Args:
+            row (dictionary): The row, keyed by the logger's output headers.
+            after (function): Optional, called with the logger on the writer
+                thread once the row has been written (eg. to write side
+                files named after the current log file).
+
+        Raises:
+            RuntimeError: If the writer has been closed.
+        """
+        if self._closed:
+            raise RuntimeError("Writer is closed.")
+        self._queue.put((row, after))
+
+    def _commit(self):
+        self.logger.flush()
+        if self.fsync == "commit":
+            self.logger.fsync()
+        self.commits += 1
+
+    def _run(self):
+        pending = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is not None and item is not _STOP:
+                row, after = item
+                try:
+                    self.logger.writerow(row)
+                    if after is not None:
+                        after(self.logger)
+                except Exception as e:
+                    print("Error writing to %s: %s" % (self.logger.path, e))
+                    traceback.print_exc()
+                pending += 1
+                self.rowsWritten += 1
+                if deadline is None:
+                    deadline = time.monotonic() + self.flushSeconds
+            if pending and (item is None or item is _STOP or
+                            pending >= self.flushRows or time.monotonic() >= deadline):
+                self._commit()
+                pending = 0
+                deadline = None
+            if item is _STOP:
+                break
+
+    def close(self):
+        """
+        Write everything still queued, then close the log file.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        if self.fsync != "never":
+            self.logger.fsync()
+        self.logger.close()
+
+
+def get_writer(name, factory, **kwargs):
+    """
+    Return the shared writer for a log stream, creating it on first use.
+
+    Args:
+        name (string): The stream name, eg. "ping".
+        factory (function): Returns the set up logger, only called the first
+            time.
+        kwargs: Passed to ResultWriter.
+    """
+    with _writers_lock:
+        if name not in _writers:
+            _writers[name] = ResultWriter(factory(), name=name, **kwargs)
+        return _writers[name]
+
+
+def close_all():
+    """
+    Drain and close every shared writer.
+    """
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
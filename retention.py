@@ -0,0 +1,468 @@
+"""
+Round robin style retention for the result logs.
+
+Raw rows are kept for rawDays days.  As RotatingCsvFile closes each file,
+the rows are rolled up into per minute, per hour and per day aggregates, and
+the raw files (with their .rtt side files) that are older than rawDays, and
+have been rolled up at every level, are removed.  Each level keeps its own
+history, so the storage stays bounded however long the monitor runs.
+
+The rollups are csv files in the rollup directory, named like the rotated
+logs (so rotating_csv.parse_filename() reads them):
+
+    minute  <YYYY-MM>-<suffix>-minute.csv   kept for minuteDays
+    hour    <YYYY>-<suffix>-hour.csv        kept for hourDays
+    day     <YYYY>-<suffix>-day.csv         kept forever (dayDays=0)
+
+A period is only rolled up once every raw row in it has been written, ie.
+once the files covering it are closed, so each period has exactly one row
+per target.  rollup.json in the rollup directory records the first and the
+last period done for each log and level, so the work is incremental and
+survives a restart, and no raw file is pruned before it has been rolled up.
+The first run starts from the oldest raw log there is.
+
+Ping logs get count, sent, received, loss, min / avg / max round trip time
+(the average weighted by the replies of each run) and the 95th percentile:
+of the individual probes when the log has a .rtt file (see rtt_store.py),
+otherwise of each run's average, in its own "P95 Of Avg" column.  Speedtest
+logs get count, min / avg / max download and upload, and the average ping.
+Other logs (traceroute) are only pruned.
+
+.. code-block:
+
+    from retention import Retention
+    retention = Retention(directory="data", rawDays=7, after=compressor.submit)
+    logger = RotatingCsvFile(..., closed_callback=retention.submit)
+    ...
+    retention.close()
+"""
+import bisect
+import json
+import os
+import queue
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from csv_common import BaseCsvFile, KeyIndex
+from rotating_csv import parse_filename, period_bounds, rotations, filename_templates
+from rtt_store import percentile, read_samples
+
+LEVELS = ("minute", "hour", "day")
+LEVEL_ROTATIONS = {"minute": rotations["Rotate_Minute"],
+                   "hour": rotations["Rotate_Hour"],
+                   "day": rotations["Rotate_Day"]}
+# Each level's rollups are written one file per month / year.
+LEVEL_FILES = {"minute": rotations["Rotate_Month"],
+               "hour": rotations["Rotate_Year"],
+               "day": rotations["Rotate_Year"]}
+
+ping_rollup_headers = ["Date", "target", "Count", "Sent", "Received", "Packet Loss #",
+                       "Min", "Avg", "Max", "P95", "P95 Of Avg"]
+speed_rollup_headers = ["Date", "target", "Count", "Min Download", "Avg Download",
+                        "Max Download", "Min Upload", "Avg Upload", "Max Upload", "Avg Ping"]
+
+STATE_FILE = "rollup.json"
+
+_STOP = object()
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _average(values):
+    return sum(values) / len(values) if values else None
+
+
+def rollup_ping(rows, probes=None):
+    """
+    Aggregate the ping rows of one period and target.
+
+    Args:
+        rows (list): The csv rows.
+        probes (list): The RTT of each probe (NaN if lost) from the .rtt
+            files, None if there are none.
+
+    >>> row = rollup_ping([{"Avg": "10", "Received": "1"}, {"Avg": "20", "Received": "3"}])
+    >>> row["Avg"], row["P95"], row["P95 Of Avg"]
+    (17.5, '', 20.0)
+    >>> row = rollup_ping([{"Avg": "2", "Received": "2"}], [1.0, 3.0, float("nan")])
+    >>> row["P95"], row["P95 Of Avg"]
+    (3.0, '')
+    """
+    averages = []
+    total = weight = 0.0
+    for row in rows:
+        average = _float(row.get("Avg"))
+        if average is None:
+            continue
+        averages.append(average)
+        received = _float(row.get("Received"))
+        received = 1.0 if received is None else received
+        total += average * received
+        weight += received
+    p95 = percentile(probes, 95) if probes else None
+    minimums = [value for value in (_float(row.get("Min")) for row in rows) if value is not None]
+    maximums = [value for value in (_float(row.get("Max")) for row in rows) if value is not None]
+    return {"Count": len(rows),
+            "Sent": int(sum(_float(row.get("Sent")) or 0 for row in rows)),
+            "Received": int(sum(_float(row.get("Received")) or 0 for row in rows)),
+            "Packet Loss #": int(sum(_float(row.get("Packet Loss #")) or 0 for row in rows)),
+            "Min": min(minimums) if minimums else "",
+            "Avg": total / weight if weight else "",
+            "Max": max(maximums) if maximums else "",
+            "P95": p95 if p95 is not None else "",
+            "P95 Of Avg": percentile(averages, 95) if averages and not probes else ""}
+
+
+def rollup_speed(rows, probes=None):
+    """
+    Aggregate the speedtest rows of one period and target.
+    """
+    downloads = [value for value in (_float(row.get("Download Speed")) for row in rows)
+                 if value is not None]
+    uploads = [value for value in (_float(row.get("Upload Speed")) for row in rows)
+               if value is not None]
+    pings = [value for value in (_float(row.get("Ping")) for row in rows) if value is not None]
+    return {"Count": len(rows),
+            "Min Download": min(downloads) if downloads else "",
+            "Avg Download": _average(downloads) if downloads else "",
+            "Max Download": max(downloads) if downloads else "",
+            "Min Upload": min(uploads) if uploads else "",
+            "Avg Upload": _average(uploads) if uploads else "",
+            "Max Upload": max(uploads) if uploads else "",
+            "Avg Ping": _average(pings) if pings else ""}
+
+
+def rollup_kind(headers):
+    """
+    Returns:
+        tuple: (rollup headers, aggregate function) for a log's headers, or
+            None if the log is not rolled up.
+    """
+    if "Avg" in headers:
+        return ping_rollup_headers, rollup_ping
+    if "Download Speed" in headers:
+        return speed_rollup_headers, rollup_speed
+    return None
+
+
+def read_log(path):
+    """
+    Returns:
+        tuple: (headers, list of (datetime, row)), rows without a date are
+            dropped.
+    """
+    source = BaseCsvFile(path)
+    source.setup_read()
+    try:
+        rows = []
+        for row in source.readrow():
+            try:
+                rows.append((datetime.fromisoformat(row.get("Date") or ""), row))
+            except ValueError:
+                continue
+        headers = source.csv_handler.fieldnames or []
+    finally:
+        source.close()
+    return headers, rows
+
+
+def read_probes(path):
+    """
+    The probes stored next to a log by RttStore.
+
+    Returns:
+        list: (datetime, target, rtt ms or NaN), empty if the log has no
+            .rtt file.
+    """
+    name = os.path.basename(str(path))
+    info = parse_filename(name)
+    rttPath = os.path.join(os.path.dirname(str(path)),
+                           name[:len(name) - len(".csv" + info["compressed"])] + ".rtt")
+    if not os.path.exists(rttPath):
+        return []
+    samples = read_samples(rttPath)
+    targets = samples.targets
+    return [(datetime.fromtimestamp(wallclock / 1e9),
+             targets[targetId] if targetId < len(targets) else "", rtt)
+            for wallclock, targetId, rtt in zip(samples.wallclock, samples.target_ids,
+                                                samples.rtts)]
+
+
+def attach_probes(rows, probes):
+    """
+    Give each probe the Date of the row of the run it belongs to: the first
+    row of its target at or after the time it was sent (a row is written
+    once its run is over), so rows and probes are bucketed on the same time.
+    Probes after the last row are dropped.
+
+    >>> rows = [(datetime(2021, 7, 23, 0, 0, 59), {"target": "a"}),
+    ...         (datetime(2021, 7, 23, 0, 1, 5), {"target": "a"})]
+    >>> attach_probes(rows, [(datetime(2021, 7, 23, 0, 1, 1), "a", 5.0)])
+    [(datetime.datetime(2021, 7, 23, 0, 1, 5), 'a', 5.0)]
+    """
+    runs = {}
+    for when, row in rows:
+        runs.setdefault(row.get("target", ""), []).append(when)
+    for dates in runs.values():
+        dates.sort()
+    attached = []
+    for when, target, rtt in probes:
+        dates = runs.get(target)
+        if not dates:
+            continue
+        index = bisect.bisect_left(dates, when)
+        if index < len(dates):
+            attached.append((dates[index], target, rtt))
+    return attached
+
+
+def read_closed(path):
+    """
+    Read a log and its probes in one pass.
+
+    Returns:
+        tuple: (headers, list of (datetime, row), list of (datetime, target,
+            rtt)), the probes dated by attach_probes().
+    """
+    headers, rows = read_log(path)
+    return headers, rows, attach_probes(rows, read_probes(path))
+
+
+class Retention():
+    """
+    Rolls up and prunes the logs on its own thread, as they are closed.
+    """
+    def __init__(self, directory="data", rollupDirectory=None, rawDays=7,
+                 minuteDays=31, hourDays=366, dayDays=0, after=None):
+        """
+        Args:
+            directory (string): Where the raw logs are.
+            rollupDirectory (string): Where the rollups go, directory/rollup
+                if None.
+            rawDays, minuteDays, hourDays, dayDays (integer): How long to
+                keep each, 0 to keep forever.
+            after (function): Called with the path of each closed file once it
+                has been rolled up (eg. BackgroundCompressor.submit).
+        """
+        self.directory = directory
+        self.rollupDirectory = rollupDirectory or os.path.join(directory, "rollup")
+        self.rawDays = rawDays
+        self.keepDays = {"minute": minuteDays, "hour": hourDays, "day": dayDays}
+        self.after = after
+        self.statePath = os.path.join(self.rollupDirectory, STATE_FILE)
+        self.state = {}
+        if os.path.exists(self.statePath):
+            with open(self.statePath) as handle:
+                self.state = json.load(handle)
+        # suffix -> the rows and probes not yet rolled up at every level
+        self.buffers = {}
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def submit(self, path):
+        """
+        Queue a closed log, suitable as RotatingCsvFile's closed_callback.
+        """
+        self._queue.put(str(path))
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            if path is _STOP:
+                break
+            try:
+                self.closed(path)
+            except Exception as e:
+                print("Error rolling up %s: %s" % (path, e))
+                traceback.print_exc()
+            if self.after is not None:
+                self.after(path)
+
+    def close(self):
+        """
+        Finish the files already queued, then stop.
+        """
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _save_state(self):
+        os.makedirs(self.rollupDirectory, exist_ok=True)
+        with open(self.statePath + ".tmp", "w") as handle:
+            json.dump(self.state, handle, indent=1, sort_keys=True)
+        os.replace(self.statePath + ".tmp", self.statePath)
+
+    def logs(self, suffix):
+        """
+        The raw logs with a suffix.
+
+        Returns:
+            list: (path, parse_filename info), plain files are preferred over
+                a compressed copy.
+        """
+        found = {}
+        for name in os.listdir(self.directory):
+            info = parse_filename(name)
+            if info is None or info["suffix"] != suffix:
+                continue
+            key = (info["date"], info["part"])
+            if key not in found or not info["compressed"]:
+                found[key] = (os.path.join(self.directory, name), info)
+        return sorted(found.values(), key=lambda entry: (entry[1]["start"], entry[1]["part"]))
+
+    def closed(self, path, now=None):
+        """
+        Roll up every period that the closing of path has completed, then
+        prune.
+        """
+        now = now or datetime.now()
+        info = parse_filename(path)
+        if info is None:
+            return
+        headers, rows, probes = read_closed(path)
+        kind = rollup_kind(headers)
+        suffix = info["suffix"]
+        if kind is not None and rows:
+            buffer = self.buffers.get(suffix)
+            if buffer is None:
+                buffer = self.buffers[suffix] = self._warm(suffix, (info["start"], info["part"]))
+            buffer["rows"].extend(rows)
+            buffer["probes"].extend(probes)
+            # Rotated by time, everything up to the end of the file's period is
+            # written.  Rotated by size, only up to its last row.
+            cutoff = info["end"] if info["end"] <= now else max(when for when, _ in rows)
+            firstRow = min(when for when, _ in rows)
+            for level in LEVELS:
+                self.rollup(suffix, level, kind, firstRow, cutoff, buffer)
+            # Only the rows of periods not rolled up at every level are kept
+            lowest = self._lowest(suffix)
+            if lowest is not None:
+                buffer["rows"] = [entry for entry in buffer["rows"] if entry[0] >= lowest]
+                buffer["probes"] = [entry for entry in buffer["probes"] if entry[0] >= lowest]
+        self.prune(suffix, now, rolledUp=kind is not None)
+
+    def _lowest(self, suffix):
+        # The start of the oldest period not rolled up at every level
+        done = self.state.get(suffix, {})
+        if not all(level in done for level in LEVELS):
+            return None
+        return min(datetime.fromisoformat(done[level]) for level in LEVELS)
+
+    def _warm(self, suffix, closing):
+        """
+        After a start, read the logs closed before the closing one whose rows
+        are not yet rolled up at every level, once.  The ones still open are
+        read when they close.
+
+        Returns:
+            dictionary: rows and probes, as from read_closed().
+        """
+        since = self._lowest(suffix)
+        buffer = {"rows": [], "probes": []}
+        for path, info in self.logs(suffix):
+            if (info["start"], info["part"]) >= closing or \
+                    (since is not None and info["end"] <= since):
+                continue
+            _, rows, probes = read_closed(path)
+            buffer["rows"].extend(entry for entry in rows if since is None or entry[0] >= since)
+            buffer["probes"].extend(entry for entry in probes if since is None or entry[0] >= since)
+        return buffer
+
+    def rollup(self, suffix, level, kind, firstRow, cutoff, buffer):
+        """
+        Roll up the complete periods of a level, from the last one done up
+        to cutoff, from the buffered rows and probes.
+        """
+        headers, aggregate = kind
+        rotation = LEVEL_ROTATIONS[level]
+        state = self.state.setdefault(suffix, {})
+        done = state.get(level)
+        if done:
+            start = datetime.fromisoformat(done)
+        else:
+            # The first run, roll up every raw log already there
+            logs = self.logs(suffix)
+            oldest = min(firstRow, logs[0][1]["start"]) if logs else firstRow
+            start = period_bounds(rotation, oldest)[0]
+        end = period_bounds(rotation, cutoff)[0]
+        if end <= start:
+            return
+        buckets = {}
+        probes = {}
+        for when, row in buffer["rows"]:
+            if start <= when < end:
+                bucket = period_bounds(rotation, when)[0]
+                buckets.setdefault((bucket, row.get("target", "")), []).append(row)
+        for when, target, rtt in buffer["probes"]:
+            if start <= when < end:
+                bucket = period_bounds(rotation, when)[0]
+                probes.setdefault((bucket, target), []).append(rtt)
+        writers = {}
+        try:
+            for (bucket, target), rows in sorted(buckets.items()):
+                fileDate = period_bounds(LEVEL_FILES[level], bucket)[0].strftime(
+                    filename_templates[LEVEL_FILES[level]])
+                if fileDate not in writers:
+                    os.makedirs(self.rollupDirectory, exist_ok=True)
+                    writer = BaseCsvFile(os.path.join(self.rollupDirectory, "%s-%s-%s.csv" % (
+                        fileDate, suffix, level)), output_headers=headers)
+                    writer.setup_append(writeheader=True)
+                    writers[fileDate] = writer
+                row = aggregate(rows, probes.get((bucket, target)))
+                row["Date"] = bucket
+                row["target"] = target
+                writers[fileDate].writerow(row)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        state[level] = end.isoformat()
+        state.setdefault("from", {}).setdefault(level, start.isoformat())
+        self._save_state()
+
+    def prune(self, suffix, now, rolledUp=True):
+        """
+        Remove the raw logs older than rawDays (and, if they are rolled up,
+        already rolled up at every level: inside the periods done) with their
+        probes and key indexes, and the rollup files older than their level's
+        retention.
+        """
+        limit = now - timedelta(days=self.rawDays) if self.rawDays else None
+        first = None
+        if limit is not None and rolledUp:
+            done = self.state.get(suffix, {})
+            if all(level in done for level in LEVELS):
+                limit = min([limit] + [datetime.fromisoformat(done[level]) for level in LEVELS])
+                started = done.get("from", {})
+                if started:
+                    first = max(datetime.fromisoformat(value) for value in started.values())
+            else:
+                limit = None
+        if limit is not None:
+            for name in os.listdir(self.directory):
+                info = parse_filename(name)
+                if info is None or info["suffix"] != suffix or info["end"] > limit:
+                    continue
+                if first is not None and info["start"] < first:
+                    # Older than anything rolled up, keep it
+                    continue
+                stem = os.path.join(self.directory, name[:len(name) - len(".csv" + info["compressed"])])
+                for path in (os.path.join(self.directory, name), stem + ".rtt", stem + ".rtt.targets"):
+                    if os.path.exists(path):
+                        os.remove(path)
+                KeyIndex.remove_indexes(stem + ".csv")
+        if not os.path.isdir(self.rollupDirectory):
+            return
+        for name in os.listdir(self.rollupDirectory):
+            info = parse_filename(name)
+            if info is None:
+                continue
+            for level in LEVELS:
+                if info["suffix"] == "%s-%s" % (suffix, level) and self.keepDays[level] and \
+                        info["end"] <= now - timedelta(days=self.keepDays[level]):
+                    os.remove(os.path.join(self.rollupDirectory, name))
@@ -1,6 +1,9 @@
-from csv_common import BaseCsvFile
-from datetime import datetime
+from csv_common import BaseCsvFile, COMPRESSED_SUFFIXES
+from datetime import datetime, timedelta
 import os, os.path
+import re
+import sys
+import time
 
 """
 from rotating_csv import RotatingCsvFile, rotations
@@ -10,71 +13,307 @@ test.writerow(....)
 # wait a minute
 test.writerow(....)
 
+# Also rotate whenever the file reaches 10MB, the extra files are named
+# "<date>-<suffix>.1.csv", "<date>-<suffix>.2.csv", ...
+test = RotatingCsvFile(output_headers=["test", "test2"], max_bytes=10*1024*1024)
+
+The time of the next rotation is worked out once, when a file is opened, so
+the check made for every row is a single comparison against time.time().
+
+Benchmark of the per row cost, against the old strptime based check:
+
+    python rotating_csv.py [rows]
 """
 
 rotations = {'Rotate_Minute' : 0,
             'Rotate_Hour' : 1,
             'Rotate_Day' : 2,
-#            'Rotate_Week' : 3,
-#            'Rotate_Month' : 4,
-#            'Rotate_Year' : 5
+            'Rotate_Week' : 3,
+            'Rotate_Month' : 4,
+            'Rotate_Year' : 5
             }
 
+filename_templates = {rotations['Rotate_Minute'] : "%Y-%m-%d %H_%M",
+                      rotations['Rotate_Hour'] : "%Y-%m-%d %H",
+                      rotations['Rotate_Day'] : "%Y-%m-%d",
+                      rotations['Rotate_Week'] : "%Y-W%W",
+                      rotations['Rotate_Month'] : "%Y-%m",
+                      rotations['Rotate_Year'] : "%Y",
+                     }
+
+# Most specific first, so "2021-07-23-..." is never read as a month.
+_filename_pattern = re.compile(
+    r"^(?P<date>\d{4}-\d{2}-\d{2} \d{2}_\d{2}|\d{4}-\d{2}-\d{2} \d{2}|\d{4}-\d{2}-\d{2}"
+    r"|\d{4}-W\d{2}|\d{4}-\d{2}|\d{4})-(?P<suffix>.*?)(?:\.(?P<part>\d+))?\.csv"
+    r"(?P<compressed>\.gz|\.zst)?$")
+_date_rotations = [(re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}_\d{2}$"), rotations["Rotate_Minute"]),
+                   (re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}$"), rotations["Rotate_Hour"]),
+                   (re.compile(r"^\d{4}-\d{2}-\d{2}$"), rotations["Rotate_Day"]),
+                   (re.compile(r"^\d{4}-W\d{2}$"), rotations["Rotate_Week"]),
+                   (re.compile(r"^\d{4}-\d{2}$"), rotations["Rotate_Month"]),
+                   (re.compile(r"^\d{4}$"), rotations["Rotate_Year"])]
+
+
+def parse_filename(name):
+    """
+    Split the name of a file written by RotatingCsvFile back into its parts.
+
+    Args:
+        name (string): The file name, with or without a directory.
+
+    Returns:
+        dictionary: rotation, date (the date part of the name), start & end
+            (datetime, the period the file covers), suffix, part (integer)
+            and compressed (".gz", ".zst" or ""), or None if it is not a
+            rotated log name.
+
+    >>> info = parse_filename("data/2021-07-23-pingresults.2.csv.gz")
+    >>> info["start"], info["end"], info["suffix"], info["part"], info["compressed"]
+    (datetime.datetime(2021, 7, 23, 0, 0), datetime.datetime(2021, 7, 24, 0, 0), 'pingresults', 2, '.gz')
+    >>> parse_filename("2021-W29-speedresults.csv")["start"]
+    datetime.datetime(2021, 7, 19, 0, 0)
+    >>> parse_filename("2021-07-23 09_47-traceresults.csv")["end"]
+    datetime.datetime(2021, 7, 23, 9, 48)
+    >>> parse_filename("notes.txt") is None
+    True
+    """
+    match = _filename_pattern.match(os.path.basename(str(name)))
+    if match is None:
+        return None
+    date = match.group("date")
+    for pattern, rotation in _date_rotations:
+        if pattern.match(date):
+            break
+    if rotation == rotations["Rotate_Week"]:
+        start = datetime.strptime(date + "-1", "%Y-W%W-%w")
+    else:
+        start = datetime.strptime(date, filename_templates[rotation])
+    return {"rotation": rotation,
+            "date": date,
+            "start": start,
+            "end": period_bounds(rotation, start)[1],
+            "suffix": match.group("suffix"),
+            "part": int(match.group("part") or 0),
+            "compressed": match.group("compressed") or ""}
+
+
+def period_bounds(rotation, now):
+    """
+    The start of the rotation period containing now, and the start of the
+    next one.
+
+    Args:
+        rotation (integer): One of the rotations values
+        now (datetime): local time
+
+    Returns:
+        tuple: (start datetime, next start datetime)
+
+    >>> period_bounds(rotations["Rotate_Week"], datetime(2021, 7, 23, 9, 47))
+    (datetime.datetime(2021, 7, 19, 0, 0), datetime.datetime(2021, 7, 26, 0, 0))
+    >>> period_bounds(rotations["Rotate_Month"], datetime(2021, 12, 23, 9, 47))[1]
+    datetime.datetime(2022, 1, 1, 0, 0)
+    """
+    if rotation == rotations["Rotate_Minute"]:
+        start = now.replace(second=0, microsecond=0)
+        return start, start + timedelta(minutes=1)
+    if rotation == rotations["Rotate_Hour"]:
+        start = now.replace(minute=0, second=0, microsecond=0)
+        return start, start + timedelta(hours=1)
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if rotation == rotations["Rotate_Day"]:
+        return midnight, midnight + timedelta(days=1)
+    if rotation == rotations["Rotate_Week"]:
+        start = midnight - timedelta(days=midnight.weekday())
+        return start, start + timedelta(days=7)
+    if rotation == rotations["Rotate_Month"]:
+        start = midnight.replace(day=1)
+        if start.month == 12:
+            return start, start.replace(year=start.year + 1, month=1)
+        return start, start.replace(month=start.month + 1)
+    if rotation == rotations["Rotate_Year"]:
+        start = midnight.replace(month=1, day=1)
+        return start, start.replace(year=start.year + 1)
+    raise ValueError("Unknown rotation: %s" % rotation)
 
 
 class RotatingCsvFile(BaseCsvFile):
     def __init__(self,
                  rotation=rotations["Rotate_Day"],
                  output_headers=[], directory='',
-                 suffix=""
+                 suffix="",
+                 max_bytes=None,
+                 closed_callback=None
                 ):
+        """
+        Args:
+            rotation (integer): One of the rotations values
+            output_headers (list): The csv headers
+            directory (string): Where the files are written
+            suffix (string): Appended to the date in the filename
+            max_bytes (integer): If set, also rotate once the file reaches
+                this size.
+            closed_callback (function): If set, called with the path of each
+                file once it has been rotated out and closed (eg.
+                BackgroundCompressor.submit).
+        """
         self.rotation_period = None
         self.directory = directory
         self.filename_template = None
+        self.next_rotation = None
+        self.max_bytes = max_bytes
+        self.closed_callback = closed_callback
+        self.part = 0
+        self.current_size = 0
         self.current_filename = self.set_rotation(rotation)
         self.headers = output_headers
         self.suffix = suffix
+        self.resume_part()
+        self.skip_compressed()
         BaseCsvFile.__init__(self,
-                             fqpn=os.path.join(self.directory,
-                                               "%s-%s.csv" % (self.current_filename,self.suffix)),
+                             fqpn=self.make_filename(),
                              output_headers=output_headers)
 
+    def resume_part(self):
+        """
+        On startup, carry on with the highest part already written for the
+        current period, or the one after it if that is full (max_bytes) or
+        has been compressed, rather than appending to part 0 again.
+        """
+        highest = None
+        try:
+            names = os.listdir(self.directory or ".")
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            info = parse_filename(name)
+            if info is None or info["date"] != self.current_filename or \
+                    info["suffix"] != self.suffix:
+                continue
+            if highest is None or (info["part"], not info["compressed"]) > \
+                    (highest["part"], not highest["compressed"]):
+                highest = info
+        if highest is None:
+            return
+        self.part = highest["part"]
+        self.current_size = 0
+        if highest["compressed"]:
+            self.part += 1
+            return
+        self.current_size = os.path.getsize(self.make_filename())
+        if self.max_bytes is not None and self.current_size >= self.max_bytes:
+            self.part += 1
+            self.current_size = 0
+
+    def skip_compressed(self):
+        """
+        Move on to the next part number while the current filename has
+        already been rotated and compressed, so it is never written again
+        (the compressor would then replace the earlier compressed copy).
+        """
+        while any(os.path.exists(self.make_filename() + suffix)
+                  for suffix in COMPRESSED_SUFFIXES):
+            self.part += 1
+
+    def make_filename(self):
+        if self.part:
+            return os.path.join(self.directory, "%s-%s.%d.csv" % (self.current_filename,
+                                                                  self.suffix, self.part))
+        return os.path.join(self.directory, "%s-%s.csv" % (self.current_filename, self.suffix))
+
     def set_rotation(self, rotation = None):
+        """
+        Set the rotation period, and work out when the current file ends.
+
+        Returns:
+            string: The date part of the current filename.
+        """
         self.rotation_period = rotation
-        if self.rotation_period == rotations["Rotate_Minute"]:
-            self.filename_template = "%Y-%m-%d %H_%M"
-        elif self.rotation_period == rotations["Rotate_Hour"]:
-            self.filename_template = "%Y-%m-%d %H"
-        elif self.rotation_period == rotations["Rotate_Day"]:
-            self.filename_template = "%Y-%m-%d"
-        return datetime.strftime(datetime.now(), self.filename_template)
+        self.filename_template = filename_templates[rotation]
+        now = datetime.now()
+        start, end = period_bounds(rotation, now)
+        self.next_rotation = end.timestamp()
+        return datetime.strftime(start, self.filename_template)
+
+    def _measure(self):
+        if self.path.exists():
+            self.current_size = self.path.stat().st_size
+        else:
+            self.current_size = 0
+
+    def setup_write(self, *args, **kwargs):
+        result = BaseCsvFile.setup_write(self, *args, **kwargs)
+        self._measure()
+        return result
+
+    def setup_append(self, *args, **kwargs):
+        result = BaseCsvFile.setup_append(self, *args, **kwargs)
+        self._measure()
+        return result
+
+    def rotate(self):
+        """
+        Close the current file, and open the next one.
+        """
+        self.close()
+        self.closed_file(self.path)
+        if time.time() >= self.next_rotation:
+            self.current_filename = self.set_rotation(self.rotation_period)
+            self.part = 0
+        else:
+            self.part += 1
+        self.skip_compressed()
+        self.path = type(self.path)(self.make_filename())
+        self.writing = False
+        self.setup_append(writeheader=True)
+
+    def closed_file(self, path):
+        """
+        *Subclass* to be told about each file once it has been rotated out and
+        closed.  By default, passes it to closed_callback.
+        """
+        if self.closed_callback is not None:
+            self.closed_callback(path)
 
     def check_rotate(self):
-        exceeded = False
-        now = datetime.now()
-        previous = datetime.strptime(self.current_filename, self.filename_template)
-        duration = now-previous
-        dur_in_sec = int(duration.total_seconds())
-        if self.rotation_period == rotations["Rotate_Minute"]:
-            exceeded = (dur_in_sec > 60)
-        elif self.rotation_period == rotations["Rotate_Hour"]:
-            exceeded = divmod(dur_in_sec, 3600)[0] >= 1
-        elif self.rotation_period == rotations["Rotate_Day"]:
-            exceeded = divmod(dur_in_sec, 86400)[0] >= 1
-#        elif self.rotation == rotations["Rotate_Week"]:
- #           exceeded == divmod(duration_in_s, 86400*7)[0] >= 1
-#        elif self.rotation == rotation["Rotate_Month"]:
-#            exceeded == divmod(duration_in_s, 86400*7*4)[0] >= 1
-#        elif self.rotation == rotation["Rotate_Year"]:
-#            exceeded == divmod(duration_in_s, 86400*7*4*12)[0] >= 1
-        if exceeded==True:
-            self.close()
-            self.__init__(rotation=self.rotation_period,
-                          output_headers=self.output_headers,
-                          directory=self.directory,
-                          suffix=self.suffix)
-            self.setup_write(writeheader=True)
+        if time.time() >= self.next_rotation or (
+                self.max_bytes is not None and self.current_size >= self.max_bytes):
+            self.rotate()
 
     def writerow(self, datadict, clean=False):
         self.check_rotate()
-        BaseCsvFile.writerow(self, datadict=datadict, clean=clean)
+        written = BaseCsvFile.writerow(self, datadict=datadict, clean=clean)
+        if written:
+            self.current_size += written
+        return written
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    def legacy_check(current_filename, filename_template):
+        # The check the old check_rotate made for every row (Rotate_Day)
+        previous = datetime.strptime(current_filename, filename_template)
+        dur_in_sec = int((datetime.now() - previous).total_seconds())
+        return divmod(dur_in_sec, 86400)[0] >= 1
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as directory:
+        test = RotatingCsvFile(output_headers=["Date", "value"], directory=directory,
+                               suffix="bench")
+        test.setup_append(writeheader=True)
+        row = {"Date": datetime.now(), "value": 1.5}
+
+        start = time.perf_counter()
+        for _ in range(rows):
+            legacy_check(test.current_filename, test.filename_template)
+            BaseCsvFile.writerow(test, row)
+        before = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(rows):
+            test.writerow(row)
+        after = time.perf_counter() - start
+        test.close()
+    print("strptime check:  %d rows/second" % (rows / before))
+    print("boundary check:  %d rows/second" % (rows / after))
@@ -0,0 +1,188 @@
+"""
+Compact storage of every individual ping probe.
+
+The ping CSV only holds the min / avg / max of each run.  RttStore keeps the
+individual probes in a fixed width binary file next to the CSV (the same name
+with a .rtt extension), so that jitter, percentiles and loss bursts can be
+computed later.
+
+Each probe is one 22 byte little-endian record:
+
+    int64   send time, time.monotonic_ns()
+    int64   send time, time.time_ns() (to line the probe up with the CSV rows)
+    uint16  target id
+    float32 round trip time in milliseconds, NaN if the probe was lost
+
+Target ids are the line numbers (from 0) of the target names listed in the
+matching ``.rtt.targets`` file.
+
+Reading the file back gives one array.array per column rather than an object
+per probe:
+
+.. code-block:
+
+    from rtt_store import read_samples, jitter, percentile, loss_bursts
+    samples = read_samples("data/2021-07-23-pingresults.rtt")
+    rtts = samples.rtts_for("8.8.8.8")
+    print(jitter(rtts), percentile(rtts, 95), loss_bursts(rtts))
+"""
+import array
+import math
+import os
+import struct
+import time
+
+RECORD = struct.Struct("<qqHf")
+NAN = float("nan")
+
+
+class RttStore():
+    """
+    Appends probe records to the .rtt file for the current CSV.
+
+    Not thread safe, the caller is expected to hold its log lock.
+    """
+    def __init__(self):
+        self.path = None
+        self.targets = {}
+        self.__fh = None
+
+    def _open(self, path):
+        self.close()
+        self.path = str(path)
+        self.targets = {}
+        if os.path.exists(self.path + ".targets"):
+            with open(self.path + ".targets") as listing:
+                for line in listing:
+                    self.targets[line.rstrip("\n")] = len(self.targets)
+        self.__fh = open(self.path, "ab")
+
+    def _target_id(self, target):
+        if target not in self.targets:
+            self.targets[target] = len(self.targets)
+            with open(self.path + ".targets", "a") as listing:
+                listing.write("%s\n" % target)
+        return self.targets[target]
+
+    def write(self, path, target, samples):
+        """
+        Append the probes of one ping run.
+
+        Args:
+            path (string): The .rtt file, it is (re)opened when this changes,
+                eg. when the CSV it sits next to rotates.
+            target (string): The pinged target.
+            samples (list): (send time monotonic ns, rtt ms or NaN) tuples.
+        """
+        if str(path) != self.path:
+            self._open(path)
+        target_id = self._target_id(target)
+        offset = time.time_ns() - time.monotonic_ns()
+        output = bytearray()
+        for send_ns, rtt in samples:
+            output += RECORD.pack(send_ns, send_ns + offset, target_id,
+                                  NAN if rtt is None else rtt)
+        self.__fh.write(output)
+        self.__fh.flush()
+
+    def close(self):
+        if self.__fh is not None:
+            self.__fh.close()
+            self.__fh = None
+
+
+class RttSamples():
+    """
+    Column arrays read back from a .rtt file.
+    """
+    def __init__(self, targets):
+        self.targets = targets
+        self.monotonic = array.array("q")
+        self.wallclock = array.array("q")
+        self.target_ids = array.array("H")
+        self.rtts = array.array("f")
+
+    def __len__(self):
+        return len(self.rtts)
+
+    def rtts_for(self, target):
+        """
+        Returns:
+            array: The RTTs (NaN for loss) of one target, in send order.
+        """
+        target_id = self.targets.index(target)
+        return array.array("f", [rtt for rtt, tid in zip(self.rtts, self.target_ids)
+                                 if tid == target_id])
+
+
+def read_samples(path):
+    """
+    Read a .rtt file into column arrays.
+
+    Returns:
+        RttSamples
+    """
+    path = str(path)
+    targets = []
+    if os.path.exists(path + ".targets"):
+        with open(path + ".targets") as listing:
+            targets = [line.rstrip("\n") for line in listing]
+    samples = RttSamples(targets)
+    with open(path, "rb") as source:
+        data = source.read()
+    # ignore a partial trailing record, eg. from a crash mid write
+    data = data[:len(data) - len(data) % RECORD.size]
+    for monotonic, wallclock, target_id, rtt in RECORD.iter_unpack(data):
+        samples.monotonic.append(monotonic)
+        samples.wallclock.append(wallclock)
+        samples.target_ids.append(target_id)
+        samples.rtts.append(rtt)
+    return samples
+
+
+def jitter(rtts):
+    """
+    Mean absolute difference between consecutive answered probes (RFC 3550
+    style, without the smoothing).
+
+    >>> jitter([10.0, 12.0, float("nan"), 11.0])
+    1.5
+    """
+    answered = [rtt for rtt in rtts if not math.isnan(rtt)]
+    if len(answered) < 2:
+        return None
+    return sum(abs(b - a) for a, b in zip(answered, answered[1:])) / (len(answered) - 1)
+
+
+def percentile(rtts, pct):
+    """
+    Nearest rank percentile of the answered probes.
+
+    >>> percentile([5.0, 1.0, 3.0, float("nan"), 2.0, 4.0], 50)
+    3.0
+    """
+    answered = sorted(rtt for rtt in rtts if not math.isnan(rtt))
+    if not answered:
+        return None
+    rank = max(1, int(math.ceil(pct / 100.0 * len(answered))))
+    return answered[rank - 1]
+
+
+def loss_bursts(rtts):
+    """
+    Lengths of each run of consecutive lost probes.
+
+    >>> loss_bursts([1.0, float("nan"), float("nan"), 2.0, float("nan")])
+    [2, 1]
+    """
+    bursts = []
+    run = 0
+    for rtt in rtts:
+        if math.isnan(rtt):
+            run += 1
+        elif run:
+            bursts.append(run)
+            run = 0
+    if run:
+        bursts.append(run)
+    return bursts
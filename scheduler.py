@@ -0,0 +1,229 @@
+"""
+Event driven scheduler for the probes.
+
+Each job is kept in a min-heap ordered by the monotonic time it is next due.
+The scheduler thread sleeps exactly until the head of the heap is due (or
+until a job is added / the scheduler is stopped), runs it, and pushes it back
+with its next due time.
+
+Next due times are computed from the previous *due* time, not from when the
+job actually ran, so intervals do not drift with probe runtime or wakeup
+latency.
+
+.. code-block:
+
+    from scheduler import ProbeScheduler
+    sched = ProbeScheduler()
+    sched.add_job("ping-8.8.8.8", 90, run_ping)
+    sched.add_job("speedtest", 1800, run_speedtest)
+    sched.run()         # blocks until sched.stop() is called
+
+Jobs that share an interval would otherwise all fire at the same instant.
+phase_offset() gives each job name a stable pseudo-random offset, so a fleet
+of targets is spread across the interval, and the spread is the same every
+time the monitor is restarted.
+"""
+import heapq
+import itertools
+import threading
+import time
+import traceback
+import zlib
+
+
+def phase_offset(name, interval, maxSpread=None):
+    """
+    Deterministic start offset for a job.
+
+    Args:
+        name (string): The job name, the offset is derived from its crc32.
+        interval (float): The job interval in seconds.
+        maxSpread (float): If set, the offset is limited to this many seconds
+            (for long intervals, eg. a 30 minute speedtest).
+
+    Returns:
+        float: Offset in seconds, in the range [0, min(interval, maxSpread)).
+
+    >>> phase_offset("ping-8.8.8.8", 90) == phase_offset("ping-8.8.8.8", 90)
+    True
+    """
+    spread = interval if maxSpread is None else min(interval, maxSpread)
+    fraction = zlib.crc32(name.encode("utf-8")) / 2.0**32
+    return fraction * spread
+
+
+class ScheduledJob():
+    """
+    A single repeating job.  Only the scheduler should create these.
+    """
+    def __init__(self, name, interval, func, due):
+        self.name = name
+        self.interval = float(interval)
+        self.func = func
+        self.due = due
+        self.cancelled = False
+        self.runCount = 0
+
+    def __repr__(self):
+        return "ScheduledJob(%r, interval=%s)" % (self.name, self.interval)
+
+
+class ProbeScheduler():
+    """
+    Min-heap of next-due times, driven by a monotonic clock.
+    """
+    def __init__(self, clock=time.monotonic):
+        """
+        Args:
+            clock (function): Returns the current time in seconds.  Must be
+                monotonic.  Defaults to time.monotonic.
+        """
+        self.clock = clock
+        self._heap = []
+        self._jobs = {}
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+
+    def _push(self, job):
+        heapq.heappush(self._heap, (job.due, next(self._sequence), job))
+
+    def add_job(self, name, interval, func, first_delay=0.0):
+        """
+        Add (or replace) a repeating job.
+
+        Args:
+            name (string): Unique name of the job (eg. "ping-8.8.8.8")
+            interval (float): Seconds between runs.
+            func (function): Called with no arguments each time the job is due.
+                This is run on the scheduler thread, so it should hand off any
+                long running work.
+            first_delay (float): Seconds before the first run.
+
+        Returns:
+            ScheduledJob: The job that was added.
+
+        Raises:
+            ValueError: If the interval is not positive.
+        """
+        if interval <= 0:
+            raise ValueError("Interval must be greater than zero.")
+        with self._cond:
+            if name in self._jobs:
+                self._jobs[name].cancelled = True
+            job = ScheduledJob(name, interval, func, self.clock() + first_delay)
+            self._jobs[name] = job
+            self._push(job)
+            self._cond.notify_all()
+        return job
+
+    def remove_job(self, name):
+        """
+        Remove a job.  The heap entry is discarded lazily when it comes due.
+
+        Returns:
+            Boolean: True if the job existed.
+        """
+        with self._cond:
+            job = self._jobs.pop(name, None)
+            if job is None:
+                return False
+            job.cancelled = True
+            self._cond.notify_all()
+        return True
+
+    def set_interval(self, name, interval):
+        """
+        Change a job's interval.  A shorter interval takes effect
+        immediately (the job is brought forward if needed), a longer one from
+        the job's next run.
+
+        Returns:
+            Boolean: True if the job exists.
+        """
+        if interval <= 0:
+            raise ValueError("Interval must be greater than zero.")
+        with self._cond:
+            job = self._jobs.get(name)
+            if job is None:
+                return False
+            job.interval = float(interval)
+            sooner = self.clock() + job.interval
+            if sooner < job.due:
+                # the old heap entry becomes stale and is skipped
+                job.due = sooner
+                self._push(job)
+                self._cond.notify_all()
+        return True
+
+    def get_job(self, name):
+        return self._jobs.get(name)
+
+    def jobs(self):
+        return list(self._jobs.values())
+
+    def stop(self):
+        """
+        Ask run() to return.  Safe to call from a signal handler.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def stopped(self):
+        return self._stopped
+
+    def _next_due_job(self):
+        """
+        Block until a job is due, or the scheduler is stopped.
+
+        Returns:
+            ScheduledJob or None: None if the scheduler has been stopped.
+        """
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, job = self._heap[0]
+                if job.cancelled or due != job.due:
+                    # stale entry (removed or rescheduled job)
+                    heapq.heappop(self._heap)
+                    continue
+                delay = due - self.clock()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                return job
+        return None
+
+    def _reschedule(self, job):
+        with self._cond:
+            if job.cancelled:
+                return
+            job.due += job.interval
+            now = self.clock()
+            if job.due <= now:
+                # We fell behind by more than a whole interval (eg. the host
+                # was suspended).  Skip the missed runs, but stay on the
+                # original phase.
+                missed = int((now - job.due) // job.interval) + 1
+                job.due += missed * job.interval
+            self._push(job)
+
+    def run(self):
+        """
+        Run jobs as they come due, until stop() is called.
+        """
+        while True:
+            job = self._next_due_job()
+            if job is None:
+                break
+            job.runCount += 1
+            try:
+                job.func()
+            except Exception as e:
+                print('Error running %s: %s' % (job.name, e))
+                traceback.print_exc()
+            self._reschedule(job)
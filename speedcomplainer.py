@@ -1,14 +1,29 @@
 import configdata
 from configdata import configdata as CONFIGURATION
 #from csv_common import BaseCsvFile
-from rotating_csv import RotatingCsvFile
+from rotating_csv import RotatingCsvFile, rotations
+from scheduler import ProbeScheduler, phase_offset
+from workerpool import ProbeWorkerPool
+from icmp_ping import IcmpPinger
+from fping_ping import FpingTransmitter
+import pingparser
+from ping_stream import StreamingPinger
+from rtt_store import RttStore
+from adaptive import AdaptiveRate
+import result_writer
+import recent_results
+from compressor import BackgroundCompressor
+from retention import Retention
+from sqlite_store import SqliteLogger
+from traceroute_store import PathStore, parse_traceroute, encode_hops
+import asyncio
 import os
 import sys
 import time
+import concurrent.futures
 from datetime import datetime
 import daemon
 import signal
-import threading
 import twitter      # python-twitter, not twitter
 import json
 import random
@@ -22,10 +37,65 @@ import humanize
 csv_ping_headers =  ['Date', 'target', 'Success', 'Sent', 'Received', 'Packet Loss #', 'Min', 'Avg', 'Max']
 csv_speed_headers = ['Date', 'target', 'Location', 'Upload Speed', 'Up readable', 'Download Speed',
                      'Down readable', 'Ping', 'Latency']
-csv_traceroute_headers = ["Date", "target", "Ping DateTime", "Packet Loss #", "capture"]
+# Path Id & Hops, see traceroute_store.py.  capture only holds the raw output when it could not be parsed.
+csv_traceroute_headers = ["Date", "target", "Ping DateTime", "Packet Loss #", "Path Id", "Hops", "capture"]
+
+# The numeric fields kept in memory for each target, see recent_results.py
+ping_history_fields = ['Sent', 'Received', 'Packet Loss #', 'Min', 'Avg', 'Max']
+speed_history_fields = ['Download Speed', 'Upload Speed', 'Ping', 'Latency']
+
+# settings.ini section -> sqlite_store stream
+sqlite_streams = {"PING": "ping", "SPEEDTEST": "speed", "TRACEROUTE": "traceroute"}
 
 
 shutdownFlag = False
+activeMonitor = None
+compressor = None
+retention = None
+
+def logWriter(section, headers):
+    """
+    The shared writer for the log named by logfilename in a settings.ini
+    section.  The log file itself is only opened the first time.
+
+    With [LOG] type=sqlite the results go to the sqlite_path database
+    instead of the rotating csv files.
+    """
+    global compressor, retention
+    log = CONFIGURATION.get("LOG", {})
+    if compressor is None and log.get("compress", "") not in ["", "none"]:
+        compressor = BackgroundCompressor(method=log["compress"])
+    if retention is None and log.get("rawdays", "") != "":
+        retention = Retention(directory="data", rawDays=log["rawdays"],
+                              minuteDays=log.get("minutedays", 31),
+                              hourDays=log.get("hourdays", 366),
+                              dayDays=log.get("daydays", 0),
+                              after=compressor.submit if compressor else None)
+    closedCallback = retention.submit if retention else (compressor.submit if compressor else None)
+    def openLog():
+        if log.get("type", "") == "sqlite":
+            return SqliteLogger(log.get("sqlite_path", "") or os.path.join("data", "speedcomplainer.db"),
+                                sqlite_streams[section], output_headers=headers)
+        logger = RotatingCsvFile(rotation=rotations[log.get("rotation", "") or "Rotate_Day"],
+                                 suffix=CONFIGURATION[section]["logfilename"],
+                                 output_headers=headers,
+                                 directory="data",
+                                 max_bytes=log.get("maxbytes", "") or None,
+                                 closed_callback=closedCallback)
+        logger.setup_append(writeheader=True)
+        return logger
+    return result_writer.get_writer(section, openLog,
+                                    flushRows=log.get("flushrows", 50),
+                                    flushMs=log.get("flushms", 1000),
+                                    fsync=log.get("fsync", "") or "close")
+
+def recentHistory(section, fields):
+    """
+    The shared in memory history of the recent results of a settings.ini
+    section, [LOG] historySize results per target.
+    """
+    return recent_results.get_history(section, fields,
+                                      capacity=CONFIGURATION.get("LOG", {}).get("historysize", 1440))
 
 def main(filename, argv):
     print("======================================")
@@ -33,24 +103,19 @@ def main(filename, argv):
     print(" Lets get noisy!                      ")
     print("======================================")
 
-    global shutdownFlag
+    global shutdownFlag, activeMonitor
     configdata.load_data(filename="settings.ini",
         ini_group=("PING", "SPEEDTEST", "TWITTER", "TRACEROUTE", "LOG"))
     print(CONFIGURATION)
     signal.signal(signal.SIGINT, shutdownHandler)
+    signal.signal(signal.SIGUSR1, reportHandler)
 
-    monitor = Monitor()
+    activeMonitor = Monitor()
 
-    while not shutdownFlag:
+    if not shutdownFlag:
         try:
-
-            monitor.run()
-
-            for i in range(0, 5):
-                if shutdownFlag:
-                    break
-                time.sleep(1)
-
+            # Blocks, sleeping until the next probe is due, until shutdown.
+            activeMonitor.run()
         except Exception as e:
             print('Error: %s' % e)
             import traceback
@@ -63,64 +128,267 @@ def shutdownHandler(signo, stack_frame):
     global shutdownFlag
     print('Got shutdown signal (%s: %s).' % (signo, stack_frame))
     shutdownFlag = True
+    if activeMonitor is not None:
+        activeMonitor.stop()
+
+def reportHandler(signo, stack_frame):
+    if activeMonitor is not None:
+        activeMonitor.report()
 
 class Monitor():
     def __init__(self):
-        self.lastPingCheck = None
-        self.lastSpeedTest = None
+        workers = CONFIGURATION.get("WORKERS", {})
+        self.pool = ProbeWorkerPool(workers=workers.get("workers", 4),
+                                    maxQueue=workers.get("queuedepth", 32))
+        self.config = json.load(open('./config.json'))
+        self.phaseSpread = workers.get("phasespread", 30)
+        self.pingTest = PingTest(numPings=CONFIGURATION["PING"]["numpings"],
+                                 pingTimeout=CONFIGURATION["PING"]["pingtimeout"],
+                                 maxWaitTime=CONFIGURATION["PING"]["maxwaittime"],
+                                 target=CONFIGURATION["PING"]["pingtarget"],
+                                 maxConcurrent=CONFIGURATION["PING"].get("maxconcurrent", 16),
+                                 engine=CONFIGURATION["PING"].get("engine", "pingparsing"),
+                                 storeRtts=CONFIGURATION["PING"].get("storertts", 1) == 1,
+                                 interval=CONFIGURATION["PING"]["runevery"],
+                                 phaseSpread=self.phaseSpread)
+        self.speedTest = SpeedTest(config=self.config)
+        self.scheduler = ProbeScheduler()
+        self.adaptiveRate = None
+        if CONFIGURATION["PING"].get("adaptive", 0) == 1:
+            self.adaptiveRate = AdaptiveRate(baseInterval=CONFIGURATION["PING"]["runevery"],
+                                             minInterval=CONFIGURATION["PING"].get("adaptivemininterval", 10),
+                                             backoff=float(CONFIGURATION["PING"].get("adaptivebackoff", 2)),
+                                             baseCount=CONFIGURATION["PING"]["numpings"],
+                                             incidentCount=CONFIGURATION["PING"].get("adaptivepings", None),
+                                             rttFactor=float(CONFIGURATION["PING"].get("adaptiverttfactor", 3)))
+        self.pingStream = None
+        if CONFIGURATION["PING"].get("mode", "burst") == "stream":
+            command = CONFIGURATION["PING"].get("streamcommand", None)
+            if isinstance(command, str):
+                command = [command]
+            self.pingStream = StreamingPinger(self.pingTest.pingTargets,
+                                              window=CONFIGURATION["PING"].get("streamwindow", 60),
+                                              interval=float(CONFIGURATION["PING"].get("streaminterval", 1)),
+                                              command=command,
+                                              onResult=self.streamResult)
+        else:
+            self.addProbe("ping", CONFIGURATION["PING"]["runevery"],
+                          self.runPingTest)
+        self.addProbe("speedtest", CONFIGURATION["SPEEDTEST"]["runevery"],
+                      self.runSpeedTest)
+
+    def addProbe(self, name, interval, func):
+        """
+        Schedule a probe, offset by its deterministic phase so that probes
+        sharing an interval do not all start at once.
+        """
+        self.scheduler.add_job(name, interval, func,
+                               first_delay=phase_offset(name, interval,
+                                                        self.phaseSpread))
+
+    def submitProbe(self, section, name, func):
+        """
+        Hand a probe run to the worker pool, applying the overrun policy
+        configured for its settings.ini section.
+        """
+        self.pool.submit_serial(name, func,
+                                policy=CONFIGURATION[section].get("overrun", "skip"),
+                                maxDepth=CONFIGURATION[section].get("overrundepth", 1))
 
     def run(self):
-        if not self.lastPingCheck or (datetime.now() - self.lastPingCheck).total_seconds() >= CONFIGURATION["PING"]["runevery"]:
-            self.runPingTest()
-            self.lastPingCheck = datetime.now()
-
-        if not self.lastSpeedTest or (datetime.now() - self.lastSpeedTest).total_seconds() >= CONFIGURATION["SPEEDTEST"]["runevery"]:
-            self.runSpeedTest()
-            self.lastSpeedTest = datetime.now()
+        if self.pingStream is not None:
+            self.pingStream.start()
+        try:
+            self.scheduler.run()
+        finally:
+            if self.pingStream is not None:
+                self.pingStream.stop()
+            self.pool.shutdown(wait=True, cancelPending=True)
+            self.pingTest.close()
+            result_writer.close_all()
+            if self.pingTest.rttStore is not None:
+                self.pingTest.rttStore.close()
+            if retention is not None:
+                retention.close()
+            if compressor is not None:
+                compressor.close()
+
+    def stop(self):
+        self.scheduler.stop()
+
+    def report(self, seconds=3600):
+        """
+        Print the loss and round trip times of each ping target, and the
+        speedtest results, over the last hour (kill -USR1 <pid>).
+        """
+        pingHistory = recentHistory("PING", ping_history_fields)
+        for target in sorted(pingHistory.targets()):
+            loss = pingHistory.ratio(target, "Packet Loss #", "Sent", seconds=seconds)
+            rtt = pingHistory.stats(target, "Avg", seconds=seconds)
+            print("%s: %s runs, loss %s, rtt min/avg/max %s/%s/%s" % (
+                target, rtt["count"], "-" if loss is None else "%.1f%%" % (loss * 100),
+                rtt["min"], rtt["mean"], rtt["max"]))
+        download = recentHistory("SPEEDTEST", speed_history_fields).stats(None, "Download Speed",
+                                                                         seconds=seconds)
+        print("speedtest: %s runs, download min/avg/max %s/%s/%s" % (
+            download["count"], download["min"], download["mean"], download["max"]))
 
     def runPingTest(self):
-        pingThread = PingTest(numPings=CONFIGURATION["PING"]["numpings"],
-                              pingTimeout=CONFIGURATION["PING"]["pingtimeout"],
-                              maxWaitTime=CONFIGURATION["PING"]["maxwaittime"],
-                              target=CONFIGURATION["PING"]["pingtarget"])
-        pingThread.start()
+        if self.adaptiveRate is None:
+            self.submitProbe("PING", "ping", self.pingTest.run)
+        else:
+            self.submitProbe("PING", "ping", self.runAdaptivePingTest)
+
+    def runAdaptivePingTest(self):
+        """
+        Run a ping sweep, then let the AdaptiveRate pick the interval and
+        ping count for the next one.
+        """
+        interval, count = self.adaptiveRate.observe(self.pingTest.run(),
+                                                     expected=len(self.pingTest.pingTargets))
+        if count != self.pingTest.numPings:
+            self.pingTest.setPingCount(count)
+        if interval != self.scheduler.get_job("ping").interval:
+            print("Ping interval now %ss, %s pings per run" % (interval, count))
+            self.scheduler.set_interval("ping", interval)
+            self.pingTest.setInterval(interval)
 
     def runSpeedTest(self):
-        speedThread = SpeedTest()
-        speedThread.start()
-
-class PingTest(threading.Thread):
-    def __init__(self, numPings=5, pingTimeout=4, maxWaitTime=8, target="8.8.8.8"):
-        super(PingTest, self).__init__()
+        self.submitProbe("SPEEDTEST", "speedtest", self.speedTest.run)
+
+    def streamResult(self, pingResults):
+        """
+        Called by the StreamingPinger with each window's summary.
+        """
+        self.pingTest.logPingResults(pingResults)
+        if pingResults["Packet Loss #"] > 0 and CONFIGURATION["TRACEROUTE"]["traceroute_target"] != "":
+            self.pool.submit_serial("traceroute",
+                                    lambda: self.pingTest.doTraceRoute(pingResults),
+                                    policy="skip")
+
+class PingTest():
+    """
+    Created once by the Monitor, run() is called by a pool worker each
+    interval.
+
+    target may be a single host or a list of hosts (pingTarget=a,b,c in
+    settings.ini).  Each sweep pings every target concurrently, with at most
+    maxConcurrent pings in flight, and logs one row per target.  With the
+    pingparsing engine each target is started at its own deterministic
+    offset ("ping-<target>", up to phaseSpread seconds and half the interval)
+    into the sweep, rather than all at the same instant.
+
+    engine selects how the pings are sent:
+        pingparsing - one system ping process per target (the default)
+        icmp        - all targets from one in-process ICMP socket, see
+                      icmp_ping.py.  Falls back to pingparsing if ICMP
+                      sockets are not permitted.
+        fping       - all targets from one fping process per sweep, see
+                      fping_ping.py.  Falls back to pingparsing if fping is
+                      not installed.
+    """
+    def __init__(self, numPings=5, pingTimeout=4, maxWaitTime=8, target="8.8.8.8",
+                 maxConcurrent=16, engine="pingparsing", storeRtts=True,
+                 interval=None, phaseSpread=0):
         self.numPings = numPings
+        self.interval = interval
+        self.phaseSpread = phaseSpread
         self.pingTimeout = pingTimeout
         self.maxWaitTime = maxWaitTime
-        self.pingTarget = target
-        header_output = False
+        if isinstance(target, str):
+            target = [target]
+        self.pingTargets = [str(host).strip() for host in target if str(host).strip() != ""]
+        self.pingTarget = self.pingTargets[0]
+        self.fanout = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=max(1, min(maxConcurrent, len(self.pingTargets))),
+                        thread_name_prefix="ping")
+        self.engine = engine
+        self.icmpPinger = IcmpPinger(count=numPings, timeout=pingTimeout)
+        self.fping = FpingTransmitter(count=numPings, timeout=pingTimeout)
+
+        self.pingWriter = logWriter("PING", csv_ping_headers)
+        # every individual probe, next to the CSV, see rtt_store.py
+        self.rttStore = RttStore() if storeRtts else None
+        self.history = recentHistory("PING", ping_history_fields)
+        self.pathStore = PathStore(os.path.join("data", "%s-paths.csv" %
+                                                CONFIGURATION["TRACEROUTE"]["logfilename"]))
+
+    def close(self):
+        self.fanout.shutdown(wait=True)
+
+    def setPingCount(self, numPings):
+        self.numPings = numPings
+        self.icmpPinger.count = numPings
+        self.fping.count = numPings
 
-        self.config = json.load(open('./config.json'))
-        self.pinglogger = RotatingCsvFile(suffix=CONFIGURATION["PING"]["logfilename"],
-                                          output_headers=csv_ping_headers,
-                                          directory="data")
-        self.pinglogger.setup_append(writeheader=True)
+    def setInterval(self, interval):
+        self.interval = interval
 
     def run(self):
-        pingResults = self.doPingTest()
-        if pingResults is None:
-            print("Ping test failed")
-        self.logPingResults(pingResults)
-        if pingResults["Packet Loss #"] > 0  and CONFIGURATION["TRACEROUTE"]["traceroute_target"] != "":
+        """
+        Returns:
+            list: The result of each target in this sweep.
+        """
+        worstLoss = None
+        results = self.sweep()
+        for pingResults in results:
+            self.logPingResults(pingResults)
+            if pingResults["Packet Loss #"] > 0 and (worstLoss is None or
+                    pingResults["Packet Loss #"] > worstLoss["Packet Loss #"]):
+                worstLoss = pingResults
+        if worstLoss is not None and CONFIGURATION["TRACEROUTE"]["traceroute_target"] != "":
 #            print("Packet Loss Detected, running traceroute...", end=' ')
-            self.doTraceRoute(pingResults)
+            self.doTraceRoute(worstLoss)
+        return results
+
+    def sweep(self):
+        """
+        Ping every target once, with the configured engine.
+
+        Returns:
+            list: The doPingTest style result of each target that succeeded.
+        """
+        if self.engine == "icmp":
+            try:
+                return asyncio.run(self.icmpPinger.ping(self.pingTargets))
+            except OSError as e:
+                print("ICMP sockets unavailable (%s), falling back to pingparsing" % e)
+                self.engine = "pingparsing"
+        elif self.engine == "fping":
+            try:
+                return self.fping.ping(self.pingTargets)
+            except FileNotFoundError:
+                print("fping is not installed, falling back to pingparsing")
+                self.engine = "pingparsing"
+
+        output = []
+        spread = min(self.phaseSpread, self.interval / 2.0) if self.interval else 0
+        offsets = sorted((phase_offset("ping-%s" % target, self.interval, spread) if spread
+                          else 0.0, target) for target in self.pingTargets)
+        start = time.monotonic()
+        futures = {}
+        for offset, target in offsets:
+            delay = start + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            futures[self.fanout.submit(self.doPingTest, target)] = target
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                pingResults = future.result()
+            except Exception as e:
+                print("Ping test to %s failed: %s" % (futures[future], e))
+                continue
+            if pingResults is None:
+                print("Ping test to %s failed" % futures[future])
+                continue
+            output.append(pingResults)
+        return output
 
     def doTraceRoute(self, pingResults):
-        #csv_traceroute_headers = ["Date", "target", "Ping DateTime", "Packet Loss #", "capture"]
+        #csv_traceroute_headers = ["Date", "target", "Ping DateTime", "Packet Loss #", "Path Id", "Hops", "capture"]
         print("Performing Traceroute, due to packet loss being detected...")
-        Traceroutelogger = RotatingCsvFile(suffix=CONFIGURATION["TRACEROUTE"]["logfilename"],
-                                                output_headers=csv_traceroute_headers,
-                                                directory="data")
-        Traceroutelogger.setup_append(writeheader=True)
-        row_data = Traceroutelogger.clear_record()
+        Traceroutelogger = logWriter("TRACEROUTE", csv_traceroute_headers)
+        row_data = Traceroutelogger.logger.clear_record()
         if CONFIGURATION["TRACEROUTE"]["logfilename"] != "":
             try:
                 tracerouteoutput = subprocess.check_output(CONFIGURATION["TRACEROUTE"]["commandline"] +\
@@ -130,17 +398,23 @@ class PingTest(threading.Thread):
             except subprocess.CalledProcessError:
                 row_data["Date"] = datetime.now()
                 row_data["capture"] = "Error running Traceroute.  Traceroute returned an error code."
-                Traceroutelogger.writerow(row_data)
+                Traceroutelogger.write(row_data)
                 return
 
             print("Traceroute Captured....")
             output = tracerouteoutput.decode('ascii').split("\n")
             row_data["Date"] = datetime.now()
-            row_data["capture"] = "\n\r".join(output)
+            hops = parse_traceroute("\n".join(output))
+            if hops:
+                # The route is stored once, the capture only refers to it
+                row_data["Path Id"] = self.pathStore.add(hops)
+                row_data["Hops"] = encode_hops(hops)
+            else:
+                row_data["capture"] = "\n\r".join(output)
             row_data["target"] = CONFIGURATION["TRACEROUTE"]["traceroute_target"]
             row_data["Ping DateTime"] = pingResults["Date"]
             row_data["Packet Loss #"] = pingResults["Packet Loss #"]
-            Traceroutelogger.writerow(row_data)
+            Traceroutelogger.write(row_data)
             print("Traceroute completed")
 #             with open(os.path.join("Data", CONFIGURATION["TRACEROUTE"]["logfilename"]+'.txt'), 'a') as tracelog:
 #                 tracelog.writelines(["%s" % datetime.now(), '\n',
@@ -150,29 +424,54 @@ class PingTest(threading.Thread):
 #                     tracelog.write("\t\t"+line+'\n')
 #                 tracelog.writelines(["-"*30, '\n'])
 
-    def doPingTest(self):
-        ping_parser = pingparsing.PingParsing()
+    def doPingTest(self, target=None):
+        if target is None:
+            target = self.pingTarget
         transmitter = pingparsing.PingTransmitter()
-        transmitter.destination = self.pingTarget
+        transmitter.destination = target
         transmitter.count = self.numPings
+        startNs = time.monotonic_ns()
         text_output = transmitter.ping()
-        results = ping_parser.parse(text_output).as_dict()
+        samples = None
+        try:
+            results = pingparser.parse(text_output.stdout)
+            # ping sends one request a second, from icmp_seq first_seq
+            replies = {seq: rtt for seq, rtt, stamp in results["replies"]}
+            first = results["first_seq"]
+            samples = [(startNs + count * 1000000000, replies.get(first + count))
+                       for count in range(results["packet_transmit"])]
+        except ValueError:
+            # Not a format the fast parser knows, let pingparsing try.
+            results = pingparsing.PingParsing().parse(text_output).as_dict()
 #csv_ping_headers =  ['Date', 'target', 'Success', 'Sent', 'Received', 'Packet Loss %', 'Min', 'Avg', 'Max']
         return { 'Date': datetime.now(),
-                 'target':self.pingTarget,
+                 'target':target,
                  'Success': results["packet_receive"],
                  'Packet Loss #' : results["packet_loss_count"],
                  'Min' : results["rtt_min"],
                  'Max' : results["rtt_max"],
                  'Avg' : results["rtt_avg"],
                  'Sent': results["packet_transmit"],
-                 'Received':results["packet_receive"]}#,
+                 'Received':results["packet_receive"],
+                 'samples': samples}
 
     def logPingResults(self, pingResults):
-        self.pinglogger.writerow(pingResults)
-
-
-class SpeedTest(threading.Thread):
+        samples = pingResults.pop("samples", None)
+        after = None
+        if samples and self.rttStore is not None:
+            target = pingResults["target"]
+            # run on the writer thread, so the .rtt file follows the csv's
+            # rotation, or the probes go into the database's probes table
+            def after(logger):
+                if isinstance(logger, SqliteLogger):
+                    logger.write_samples(target, samples)
+                else:
+                    self.rttStore.write(logger.path.with_suffix(".rtt"), target, samples)
+        self.pingWriter.write(pingResults, after=after)
+        self.history.append(pingResults)
+
+
+class SpeedTest():
     """
     >>> results
 {'download': 53248457.88897891, 'upload': 3830040.891172554, 'ping': 42.373,
@@ -186,14 +485,12 @@ class SpeedTest(threading.Thread):
            'isp': 'Spectrum', 'isprating': '3.7', 'rating': '0', 'ispdlavg': '0',
            'ispulavg': '0', 'loggedin': '0', 'country': 'US'}}
     """
-    def __init__(self):
-        super(SpeedTest, self).__init__()
-        header_output = False
-        self.config = json.load(open('./config.json'))
-        self.speedlogger = RotatingCsvFile(suffix=CONFIGURATION["SPEEDTEST"]["logfilename"],
-                                          output_headers=csv_speed_headers,
-                                          directory="data")
-        self.speedlogger.setup_append(writeheader=True)
+    def __init__(self, config=None):
+        if config is None:
+            config = json.load(open('./config.json'))
+        self.config = config
+        self.speedWriter = logWriter("SPEEDTEST", csv_speed_headers)
+        self.history = recentHistory("SPEEDTEST", speed_history_fields)
 #        self.speedlogger = BaseCsvFile(CONFIGURATION["SPEEDTEST"]["logfilename"],
 #                                      output_headers=csv_speed_headers)
 #        self.speedlogger.setup_append(writeheader=True)
@@ -243,12 +540,23 @@ class SpeedTest(threading.Thread):
         return test_results
 
     def logSpeedTestResults(self, speedTestResults):
-        self.speedlogger.writerow(speedTestResults)
+        self.speedWriter.write(speedTestResults)
+        # Failed runs are logged with -1, keep them out of the averages
+        if speedTestResults['Download Speed'] >= 0:
+            self.history.append(speedTestResults)
 
 
     def tweetResults(self, speedTestResults):
+        """
+        Besides {tweetTo}, {internetSpeed} and {downloadResult}, the messages
+        can use {averageDownload} (the mean download over the last day) and
+        {recentLoss} (the ping loss over the last hour).
+        """
         thresholdMessages = self.config['tweetThresholds']
         message = None
+        averageDownload = self.history.stats(None, 'Download Speed', seconds=86400)["mean"]
+        recentLoss = recentHistory("PING", ping_history_fields).ratio(None, 'Packet Loss #', 'Sent',
+                                                                      seconds=3600)
         for (threshold, messages) in list(thresholdMessages.items()):
             threshold = float(threshold)
             if speedTestResults['Download Speed'] < threshold:
@@ -256,6 +564,8 @@ class SpeedTest(threading.Thread):
                                     self.config['tweetTo']).replace('{internetSpeed}', self.config['internetSpeed']).replace('{downloadResult}', str(speedTestResults['Download Speed']))
 
         if message:
+            message = message.replace('{averageDownload}', str(averageDownload)).replace(
+                '{recentLoss}', "%.1f%%" % (recentLoss * 100) if recentLoss is not None else "0%")
             api = twitter.Api(consumer_key=self.config['twitter']['twitterConsumerKey'],
                             consumer_secret=self.config['twitter']['twitterConsumerSecret'],
                             access_token_key=self.config['twitter']['twitterToken'],
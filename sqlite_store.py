@@ -0,0 +1,216 @@
+"""
+SQLite storage backend for the results.
+
+Selected with ``type=sqlite`` in the [LOG] section of settings.ini.  Ping,
+speedtest and traceroute results go into typed tables of one database, each
+indexed on (target, epoch), so a query over a time range for one target is an
+index lookup rather than a scan of every CSV file.  The individual ping
+probes, kept in .rtt files next to the csv logs, go into the probes table.
+
+The database runs in WAL mode, so readers do not block the writers, and
+SqliteLogger only inserts the rows it has buffered when flush() is called, in
+one transaction.  It has the same writerow / flush / fsync / close interface
+as BaseCsvFile, so the ResultWriter's group commit decides the batch size.
+
+.. code-block:
+
+    from sqlite_store import SqliteLogger, query
+    logger = SqliteLogger("data/speedcomplainer.db", "ping")
+    logger.writerow({"Date": datetime.now(), "target": "8.8.8.8", ...})
+    logger.flush()
+
+    for row in query("data/speedcomplainer.db", "ping", target="8.8.8.8",
+                     start=datetime(2021, 7, 1), end=datetime(2021, 8, 1)):
+        print(row["epoch"], row["rtt_avg"])
+"""
+import os
+import pathlib
+import sqlite3
+import time
+from datetime import datetime
+
+# stream -> (table, [(csv header, column, column type)])
+SCHEMAS = {
+    "ping": ("ping", [("Date", "epoch", "REAL NOT NULL"),
+                      ("target", "target", "TEXT"),
+                      ("Success", "success", "INTEGER"),
+                      ("Sent", "sent", "INTEGER"),
+                      ("Received", "received", "INTEGER"),
+                      ("Packet Loss #", "loss", "INTEGER"),
+                      ("Min", "rtt_min", "REAL"),
+                      ("Avg", "rtt_avg", "REAL"),
+                      ("Max", "rtt_max", "REAL")]),
+    "speed": ("speed", [("Date", "epoch", "REAL NOT NULL"),
+                        ("target", "target", "TEXT"),
+                        ("Location", "location", "TEXT"),
+                        ("Upload Speed", "upload", "REAL"),
+                        ("Up readable", "up_readable", "TEXT"),
+                        ("Download Speed", "download", "REAL"),
+                        ("Down readable", "down_readable", "TEXT"),
+                        ("Ping", "ping", "REAL"),
+                        ("Latency", "latency", "REAL")]),
+    "traceroute": ("traceroute", [("Date", "epoch", "REAL NOT NULL"),
+                                  ("target", "target", "TEXT"),
+                                  ("Ping DateTime", "ping_epoch", "REAL"),
+                                  ("Packet Loss #", "loss", "INTEGER"),
+                                  ("Path Id", "path_id", "TEXT"),
+                                  ("Hops", "hops", "TEXT"),
+                                  ("capture", "capture", "TEXT")]),
+    # every ping probe, rtt NULL if it was lost (the .rtt files of the csv logs)
+    "probes": ("probes", [("Date", "epoch", "REAL NOT NULL"),
+                          ("target", "target", "TEXT"),
+                          ("RTT", "rtt", "REAL")]),
+}
+
+
+def to_epoch(value):
+    """
+    Convert a datetime (or a string written by str(datetime)) to epoch
+    seconds.  Empty values become None.
+    """
+    if value in (None, ""):
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(str(value)).timestamp()
+
+
+def connect(path):
+    """
+    Open the database, creating the tables and indexes if needed.
+    """
+    connection = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    with connection:
+        for table, columns in SCHEMAS.values():
+            connection.execute("CREATE TABLE IF NOT EXISTS %s (id INTEGER PRIMARY KEY, %s)" % (
+                table, ", ".join("%s %s" % (column, kind) for _, column, kind in columns)))
+            connection.execute("CREATE INDEX IF NOT EXISTS %s_target_epoch ON %s (target, epoch)"
+                               % (table, table))
+            # Columns added since the database was created
+            existing = {row[1] for row in connection.execute("PRAGMA table_info(%s)" % table)}
+            for _, column, kind in columns:
+                if column not in existing:
+                    connection.execute("ALTER TABLE %s ADD COLUMN %s %s" % (
+                        table, column, kind.replace(" NOT NULL", "")))
+    return connection
+
+
+class SqliteLogger():
+    """
+    Buffers rows of one stream, and inserts them in one transaction per
+    flush().
+    """
+    def __init__(self, path, stream, output_headers=None):
+        """
+        Args:
+            path (string): The database file.
+            stream (string): "ping", "speed" or "traceroute"
+            output_headers (list): The csv headers, for clear_record().
+
+        Raises:
+            ValueError: On an unknown stream.
+        """
+        if stream not in SCHEMAS:
+            raise ValueError("Unknown stream: %s" % stream)
+        self.path = pathlib.Path(path)
+        if self.path.parent != pathlib.Path(""):
+            os.makedirs(str(self.path.parent), exist_ok=True)
+        self.stream = stream
+        self.table, self.columns = SCHEMAS[stream]
+        self.output_headers = output_headers or [header for header, _, _ in self.columns]
+        self.connection = connect(self.path)
+        self.insert = "INSERT INTO %s (%s) VALUES (%s)" % (
+            self.table, ", ".join(column for _, column, _ in self.columns),
+            ", ".join("?" * len(self.columns)))
+        self.pending = []
+        self.pendingProbes = []
+
+    def clear_record(self):
+        return dict.fromkeys(self.output_headers, "")
+
+    def writerow(self, datadict, clean=False):
+        values = []
+        for header, column, kind in self.columns:
+            value = datadict.get(header)
+            if column.endswith("epoch"):
+                value = to_epoch(value)
+            elif value == "":
+                value = None
+            values.append(value)
+        self.pending.append(values)
+
+    def write_samples(self, target, samples):
+        """
+        Buffer the probes of one ping run for the probes table, the sqlite
+        counterpart of RttStore.write.
+
+        Args:
+            target (string): The pinged target.
+            samples (list): (send time monotonic ns, rtt ms or None) tuples.
+        """
+        offset = time.time_ns() - time.monotonic_ns()
+        for send_ns, rtt in samples:
+            self.pendingProbes.append(((send_ns + offset) / 1e9, target, rtt))
+
+    def flush(self):
+        if not self.pending and not self.pendingProbes:
+            return
+        with self.connection:
+            if self.pending:
+                self.connection.executemany(self.insert, self.pending)
+            if self.pendingProbes:
+                self.connection.executemany(
+                    "INSERT INTO probes (epoch, target, rtt) VALUES (?, ?, ?)", self.pendingProbes)
+        self.pending = []
+        self.pendingProbes = []
+
+    def fsync(self):
+        self.flush()
+        self.connection.execute("PRAGMA wal_checkpoint(FULL)")
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+def query(path, stream, target=None, start=None, end=None):
+    """
+    Rows of a stream for a target (or all targets) and time range.
+
+    Args:
+        path (string): The database file.
+        stream (string): "ping", "speed", "traceroute" or "probes"
+        target (string): If None, every target.
+        start, end (datetime): The range, start inclusive, end exclusive.
+            Either may be None.
+
+    Yields:
+        sqlite3.Row: In time order.
+    """
+    table, _ = SCHEMAS[stream]
+    clauses = []
+    arguments = []
+    if target is not None:
+        clauses.append("target = ?")
+        arguments.append(target)
+    if start is not None:
+        clauses.append("epoch >= ?")
+        arguments.append(to_epoch(start))
+    if end is not None:
+        clauses.append("epoch < ?")
+        arguments.append(to_epoch(end))
+    sql = "SELECT * FROM %s" % table
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY epoch"
+    connection = connect(path)
+    try:
+        for row in connection.execute(sql, arguments):
+            yield row
+    finally:
+        connection.close()
@@ -0,0 +1,217 @@
+"""
+Structured, deduplicated storage of the traceroute captures.
+
+The traceroute (or ``mtr -r``) output is parsed into one record per hop:
+TTL, address, min / avg / max round trip time and loss.  The route itself,
+the address at each TTL, is stored once per distinct path in a small CSV
+(``<logfilename>-paths.csv``), keyed by a hash of its content.  Each capture
+then only needs the path id and the per hop measurements:
+
+    Path Id      Hops
+    9b1f2c3d4e5f6a7b    0.48/0.51/0.6/0;8.1/8.9/9.0/0;*
+
+Hops are separated by ";", each hop is "min/avg/max/loss" (loss as a
+fraction of the probes sent), or "*" if nothing answered.
+
+.. code-block:
+
+    from traceroute_store import PathStore, parse_traceroute, encode_hops
+    store = PathStore("data/traceresults-paths.csv")
+    hops = parse_traceroute(output)
+    row["Path Id"] = store.add(hops)
+    row["Hops"] = encode_hops(hops)
+    ...
+    store.expand(row["Path Id"], row["Hops"])       # the hop records again
+"""
+import hashlib
+import os
+import re
+import threading
+from datetime import datetime
+
+from csv_common import BaseCsvFile
+
+path_headers = ["Path Id", "Hop", "Address", "First Seen"]
+
+_hop_line = re.compile(r"^\s*(\d+)\s+(.*)$")
+_mtr_line = re.compile(r"^\s*(\d+)\.\|--\s+(\S+)\s+([\d.]+)%?\s+(\d+)\s+([\d.]+)\s+([\d.]+)"
+                       r"\s+([\d.]+)\s+([\d.]+)")
+
+
+def _parse_probes(text):
+    # The rest of a traceroute hop line: "host (ip)  0.5 ms  0.4 ms *"
+    addresses = []
+    rtts = []
+    lost = 0
+    tokens = text.split()
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        if token == "*":
+            lost += 1
+        elif index + 1 < len(tokens) and tokens[index + 1] == "ms":
+            try:
+                rtts.append(float(token))
+            except ValueError:
+                pass
+            index += 1
+        elif token.startswith("(") and token.endswith(")"):
+            # The ip after a hostname, it identifies the hop better
+            if addresses:
+                addresses[-1] = token[1:-1]
+            else:
+                addresses.append(token[1:-1])
+        elif not token.startswith("!") and token not in addresses:
+            addresses.append(token)
+        index += 1
+    return addresses, rtts, lost
+
+
+def parse_traceroute(text):
+    """
+    Parse traceroute or ``mtr -r`` output.
+
+    Returns:
+        list: A dictionary per hop, with ttl, address ("*" if nothing
+            answered, addresses joined by "|" if several did), rtt_min,
+            rtt_avg, rtt_max (None if nothing answered), loss (0 to 1) and
+            sent.
+
+    >>> hops = parse_traceroute('''traceroute to www.google.com (142.250.80.36), 30 hops max
+    ...  1  _gateway (192.168.1.1)  0.512 ms  0.480 ms  0.461 ms
+    ...  2  * * *
+    ...  3  10.0.0.1 (10.0.0.1)  8.1 ms 72.14.1.1 (72.14.1.1)  9.0 ms *''')
+    >>> [(hop["ttl"], hop["address"], hop["rtt_avg"], hop["loss"]) for hop in hops]
+    [(1, '192.168.1.1', 0.484, 0.0), (2, '*', None, 1.0), (3, '10.0.0.1|72.14.1.1', 8.55, 0.333)]
+    >>> parse_traceroute('''HOST: box     Loss%   Snt   Last   Avg  Best  Wrst StDev
+    ...   1.|-- _gateway    0.0%    10    0.5   0.5   0.4   0.6   0.0
+    ...   2.|-- ???        100.0    10    0.0   0.0   0.0   0.0   0.0''')[1]["address"]
+    '*'
+    """
+    hops = []
+    for line in text.splitlines():
+        match = _mtr_line.match(line)
+        if match is not None:
+            ttl, address, loss, sent, last, avg, best, worst = match.groups()
+            loss = float(loss) / 100.0
+            answered = loss < 1.0
+            hops.append({"ttl": int(ttl),
+                         "address": address if address != "???" else "*",
+                         "rtt_min": float(best) if answered else None,
+                         "rtt_avg": float(avg) if answered else None,
+                         "rtt_max": float(worst) if answered else None,
+                         "loss": round(loss, 3),
+                         "sent": int(sent)})
+            continue
+        match = _hop_line.match(line)
+        if match is None:
+            continue
+        addresses, rtts, lost = _parse_probes(match.group(2))
+        sent = len(rtts) + lost
+        hops.append({"ttl": int(match.group(1)),
+                     "address": "|".join(addresses) or "*",
+                     "rtt_min": min(rtts) if rtts else None,
+                     "rtt_avg": round(sum(rtts) / len(rtts), 3) if rtts else None,
+                     "rtt_max": max(rtts) if rtts else None,
+                     "loss": round(lost / sent, 3) if sent else 1.0,
+                     "sent": sent})
+    return hops
+
+
+def path_id(hops):
+    """
+    The id of the route: a hash of the address at each TTL.
+    """
+    route = "\n".join("%d %s" % (hop["ttl"], hop["address"]) for hop in hops)
+    return hashlib.sha1(route.encode("utf-8")).hexdigest()[:16]
+
+
+def encode_hops(hops):
+    """
+    The per hop measurements of a capture, "min/avg/max/loss;..."
+
+    >>> encode_hops([{"rtt_min": 0.4, "rtt_avg": 0.5, "rtt_max": 0.6, "loss": 0.0},
+    ...              {"rtt_min": None, "rtt_avg": None, "rtt_max": None, "loss": 1.0}])
+    '0.4/0.5/0.6/0;*'
+    """
+    encoded = []
+    for hop in hops:
+        if hop["rtt_avg"] is None:
+            encoded.append("*")
+        else:
+            encoded.append("/".join("%g" % hop[field] for field in
+                                    ("rtt_min", "rtt_avg", "rtt_max", "loss")))
+    return ";".join(encoded)
+
+
+def decode_hops(text):
+    """
+    The reverse of encode_hops.
+
+    Returns:
+        list: A (rtt_min, rtt_avg, rtt_max, loss) tuple per hop.
+    """
+    decoded = []
+    for hop in text.split(";") if text else []:
+        if hop == "*":
+            decoded.append((None, None, None, 1.0))
+        else:
+            decoded.append(tuple(float(value) for value in hop.split("/")))
+    return decoded
+
+
+class PathStore():
+    """
+    The distinct routes, each stored once.
+    """
+    def __init__(self, filename):
+        """
+        Args:
+            filename (string): The paths csv, created if it does not exist.
+        """
+        self.filename = filename
+        self.paths = {}
+        self._lock = threading.Lock()
+        if os.path.exists(filename):
+            reader = BaseCsvFile(filename)
+            reader.setup_read()
+            for row in reader.readrow():
+                self.paths.setdefault(row["Path Id"], []).append((int(row["Hop"]), row["Address"]))
+            reader.close()
+
+    def add(self, hops):
+        """
+        Store the route of hops if it is new.
+
+        Returns:
+            string: Its path id.
+        """
+        pathId = path_id(hops)
+        with self._lock:
+            if pathId not in self.paths:
+                directory = os.path.dirname(self.filename)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                writer = BaseCsvFile(self.filename, output_headers=path_headers)
+                writer.setup_append(writeheader=True)
+                now = datetime.now()
+                for hop in hops:
+                    writer.writerow({"Path Id": pathId, "Hop": hop["ttl"],
+                                     "Address": hop["address"], "First Seen": now})
+                writer.close()
+                self.paths[pathId] = [(hop["ttl"], hop["address"]) for hop in hops]
+        return pathId
+
+    def expand(self, pathId, encodedHops):
+        """
+        Rebuild the hop records of a capture from its path id and Hops.
+
+        Raises:
+            KeyError: If the path id is unknown.
+        """
+        hops = []
+        for (ttl, address), (rttMin, rttAvg, rttMax, loss) in zip(self.paths[pathId],
+                                                                 decode_hops(encodedHops)):
+            hops.append({"ttl": ttl, "address": address, "rtt_min": rttMin,
+                         "rtt_avg": rttAvg, "rtt_max": rttMax, "loss": loss})
+        return hops
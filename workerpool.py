@@ -0,0 +1,247 @@
+"""
+Bounded pool of long lived worker threads for probe jobs.
+
+The scheduler hands probe work to the pool instead of starting a new thread
+for every run.  The number of threads and the depth of the pending queue are
+both fixed, so slow probes can not cause unbounded thread creation; when the
+queue is full the job is rejected (and counted) instead.
+
+.. code-block:
+
+    from workerpool import ProbeWorkerPool
+    pool = ProbeWorkerPool(workers=4, maxQueue=32)
+    pool.submit("ping", pingtest.run)
+    pool.submit_serial("speedtest", speedtest.run, policy="coalesce")
+    print(pool.metrics())
+    pool.shutdown()
+
+Jobs submitted with submit_serial() never overlap with another run of the
+same key.  What happens when a run is requested while the previous one is
+still queued or running is decided by the overrun policy:
+
+    * skip      - the new run is dropped.
+    * coalesce  - at most one run waits behind the current one, later
+                  requests are merged into it.
+    * queue     - up to maxDepth runs wait behind the current one, any more
+                  are dropped.
+"""
+import collections
+import queue
+import threading
+import traceback
+
+_STOP = object()
+
+OVERRUN_POLICIES = ("skip", "coalesce", "queue")
+
+
+class ProbeWorkerPool():
+    """
+    Fixed size thread pool with a bounded job queue and simple metrics.
+    """
+    def __init__(self, workers=4, maxQueue=32, name="probe"):
+        """
+        Args:
+            workers (integer): Number of worker threads.
+            maxQueue (integer): Maximum number of jobs waiting for a worker.
+            name (string): Prefix for the worker thread names.
+
+        Raises:
+            ValueError: If workers or maxQueue are not positive.
+        """
+        if workers < 1 or maxQueue < 1:
+            raise ValueError("workers and maxQueue must be at least 1.")
+        self.workerCount = workers
+        self.maxQueue = maxQueue
+        self._queue = queue.Queue(maxsize=maxQueue)
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0,
+                       "rejected": 0,
+                       "completed": 0,
+                       "failed": 0,
+                       "active": 0,
+                       "max_depth": 0,
+                       "skipped": 0,
+                       "coalesced": 0}
+        self._serial = {}
+        self._closed = False
+        self._threads = []
+        for count in range(workers):
+            worker = threading.Thread(target=self._worker,
+                                      name="%s-worker-%d" % (name, count),
+                                      daemon=True)
+            worker.start()
+            self._threads.append(worker)
+
+    def submit(self, name, func, *args, **kwargs):
+        """
+        Queue func(*args, **kwargs) to be run by a worker.
+
+        Args:
+            name (string): Name of the job, used in error messages.
+            func (function): The callable to run.
+
+        Returns:
+            Boolean: True if queued, False if the pool is shut down or the
+                queue is full.
+        """
+        return self._enqueue((name, func, args, kwargs, None))
+
+    def submit_serial(self, key, func, policy="skip", maxDepth=1):
+        """
+        Queue func() so that it never runs at the same time as another job
+        submitted with the same key.
+
+        Args:
+            key (string): Serialisation key, normally the probe name.
+            func (function): The callable to run, with no arguments.
+            policy (string): The overrun policy, one of OVERRUN_POLICIES.
+            maxDepth (integer): For the "queue" policy, the number of runs
+                allowed to wait behind the current one.
+
+        Returns:
+            Boolean: True if the run was queued (or merged into a waiting
+                run), False if it was dropped.
+
+        Raises:
+            ValueError: On an unknown policy.
+        """
+        if policy not in OVERRUN_POLICIES:
+            raise ValueError("Unknown overrun policy: %s" % policy)
+        with self._lock:
+            state = self._serial.setdefault(key, {"busy": False,
+                                                  "pending": collections.deque()})
+            if state["busy"]:
+                pending = state["pending"]
+                if policy == "coalesce":
+                    if pending:
+                        pending[-1] = func
+                        self._stats["coalesced"] += 1
+                    else:
+                        pending.append(func)
+                    return True
+                if policy == "queue" and len(pending) < maxDepth:
+                    pending.append(func)
+                    return True
+                self._stats["skipped"] += 1
+                return False
+            state["busy"] = True
+        if not self._enqueue((key, func, (), {}, key)):
+            with self._lock:
+                state["busy"] = False
+            return False
+        return True
+
+    def _enqueue(self, item):
+        if self._closed:
+            return False
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected"] += 1
+            print("Worker queue full, dropping %s" % item[0])
+            return False
+        with self._lock:
+            self._stats["submitted"] += 1
+            self._stats["max_depth"] = max(self._stats["max_depth"],
+                                           self._queue.qsize())
+        return True
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+            name, func, args, kwargs, key = item
+            if key is None:
+                self._execute(name, func, args, kwargs)
+            else:
+                self._run_serial(key, func)
+            self._queue.task_done()
+
+    def _execute(self, name, func, args, kwargs):
+        with self._lock:
+            self._stats["active"] += 1
+        try:
+            func(*args, **kwargs)
+            outcome = "completed"
+        except Exception as e:
+            print('Error running %s: %s' % (name, e))
+            traceback.print_exc()
+            outcome = "failed"
+        with self._lock:
+            self._stats["active"] -= 1
+            self._stats[outcome] += 1
+
+    def _run_serial(self, key, func):
+        """
+        Run func, then any runs that piled up behind it, on this worker.
+        """
+        while func is not None:
+            self._execute(key, func, (), {})
+            with self._lock:
+                state = self._serial[key]
+                if state["pending"]:
+                    func = state["pending"].popleft()
+                else:
+                    state["busy"] = False
+                    func = None
+
+    def is_busy(self, key):
+        """
+        Returns:
+            Boolean: True if a serial job with this key is queued or running.
+        """
+        with self._lock:
+            return key in self._serial and self._serial[key]["busy"]
+
+    def queue_depth(self):
+        """
+        Returns:
+            Integer: Number of jobs waiting for a worker.
+        """
+        return self._queue.qsize()
+
+    def metrics(self):
+        """
+        Returns:
+            Dictionary: A snapshot of the pool counters, plus the current
+                queue depth and the serial runs waiting behind a busy key.
+        """
+        with self._lock:
+            output = dict(self._stats)
+            output["serial_pending"] = sum(len(state["pending"])
+                                           for state in self._serial.values())
+        output["queue_depth"] = self._queue.qsize()
+        output["workers"] = self.workerCount
+        output["max_queue"] = self.maxQueue
+        return output
+
+    def shutdown(self, wait=True, cancelPending=False):
+        """
+        Stop accepting jobs and stop the workers once the queue is drained.
+
+        Args:
+            wait (Boolean): If True, block until the workers have exited.
+            cancelPending (Boolean): If True, discard jobs that have not
+                started yet instead of running them.
+        """
+        self._closed = True
+        if cancelPending:
+            with self._lock:
+                for state in self._serial.values():
+                    state["pending"].clear()
+            try:
+                while True:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+            except queue.Empty:
+                pass
+        for _ in self._threads:
+            # blocking put, the queue may still be draining
+            self._queue.put(_STOP)
+        if wait:
+            for worker in self._threads:
+                worker.join()